@@ -11,8 +11,10 @@ import termios
 
 from cflib           import crazyflie, crtp
 from controller      import ControllerThread
-from multiprocessing import Process, Queue
+from multiprocessing import Process
+from protocol        import CommandRing
 from server          import runServer, runPathPlanner
+from timing          import TickTimings
 
 # Set a channel - if set to None, the first available crazyflie is used
 URI = 'radio://0/110/2M'
@@ -112,16 +114,19 @@ if __name__ == "__main__":
     logging.basicConfig()
     crtp.init_drivers(enable_debug_driver = False)
 
-    # the command queue for the crazyflie
-    crazyflieCommandQueue = Queue()
+    # the command queue for the crazyflie, in shared memory
+    crazyflieCommandQueue = CommandRing()
+
+    # the timings of the control loop, in shared memory
+    timings = TickTimings(ControllerThread.dt)
 
     # set up the crazyflie
     cf = crazyflie.Crazyflie(rw_cache = './cache')
-    control = ControllerThread(cf, crazyflieCommandQueue)
+    control = ControllerThread(cf, crazyflieCommandQueue, timings)
     control.start()
 
     # start the web interface to the crazyflie
-    server = Process(target = runServer, args = ("0.0.0.0", 8000, crazyflieCommandQueue))
+    server = Process(target = runServer, args = ("0.0.0.0", 8000, crazyflieCommandQueue, timings))
     server.start()
 
     # start the path planning server
@@ -7,6 +7,9 @@ import time
 import transformations as trans
 
 from cflib.crazyflie.log import LogConfig
+from flightlog           import FlightLogWriter
+from scheduler           import FixedRateScheduler
+from timing              import TickTimings
 from threading           import Thread
 from multiprocessing     import Process
 from path                import *
@@ -87,6 +90,7 @@ class StopCommand(Command):
 # The controller thread for the crazyflie.
 class ControllerThread(Thread):
     period_in_ms = 20  # Control period. [ms]
+    overrun_policy = "skip" # What to do when a period is overrun, see scheduler.py
     thrust_step = 5000 # Thrust step with W/S. [65535 = 100% PWM duty cycle]
     thrust_initial = 0
     thrust_limit = (0, 65535)
@@ -102,11 +106,17 @@ class ControllerThread(Thread):
     ey_int = 0
     ez_int = 0
 
-    def __init__(self, cf, commandQueue):
+    def __init__(self, cf, commandQueue, timings=None):
         super(ControllerThread, self).__init__()
         self.cf = cf
         self.commandQueue = commandQueue
 
+        # How long the phases of every control period take, see timing.py
+        self.timings = timings if timings is not None else TickTimings(self.dt)
+
+        # Keeps the control loop at its rate, see scheduler.py
+        self.scheduler = FixedRateScheduler(1e-3*self.period_in_ms, self.overrun_policy)
+
         # Reset state
         self.disable(stop=False)
 
@@ -244,11 +254,12 @@ class ControllerThread(Thread):
         print('[INFO ] Initial thrust reference:', self.thrust_r)
         print('[INFO ] Ready! Press e to enable motors, h for help and Q to quit')
 
-        log_file_name = 'flightlog_' + time.strftime("%Y%m%d_%H%M%S") + '.csv'
-        with open(log_file_name, 'w') as fh:
-            t0 = time.time()
+        log_file_name = 'flightlog_' + time.strftime("%Y%m%d_%H%M%S") + '.bin'
+        with FlightLogWriter(log_file_name) as flight_log:
+            t0 = time.monotonic()
+            self.scheduler.start()
             while True:
-                time_start = time.time()
+                tick_start = time.perf_counter()
 
                 # set the new target position if we have reached the current target sufficiently well
                 if np.linalg.norm(self.pos_ref - self.pos) < tolerance and not position_found:
@@ -258,26 +269,34 @@ class ControllerThread(Thread):
                     self.commandQueue.get().execute(self)
                     position_found = False
 
+                command_done = time.perf_counter()
+
                 # calculate the control signals to reach the desired position
                 self.calc_control_signals()
 
+                control_done  = time.perf_counter()
+                setpoint_done = control_done
+
                 if self.enabled:
                     sp = (self.roll_r, self.pitch_r, self.yawrate_r, int(self.thrust_r))
                     self.send_setpoint(*sp)
-                    # Log data to file for analysis
-                    ld = np.r_[time.time() - t0]
-                    ld = np.append(ld, np.asarray(sp))
-                    ld = np.append(ld, self.pos_ref)
-                    ld = np.append(ld, self.yaw_ref)
-                    ld = np.append(ld, self.pos)
-                    ld = np.append(ld, self.vel)
-                    ld = np.append(ld, self.attq)
-                    ld = np.append(ld, (np.reshape(self.R, -1)))
-                    ld = np.append(ld, trans.euler_from_quaternion(self.attq))
-                    ld = np.append(ld, self.stab_att)
-                    fh.write(','.join(map(str, ld)) + '\n')
-                    fh.flush()
-                self.loop_sleep(time_start)
+                    setpoint_done = time.perf_counter()
+                    # Log data to file for analysis, see flightlog.py
+                    flight_log.append(time.monotonic() - t0, sp, self.pos_ref, self.yaw_ref, self.pos, self.vel,
+                                      self.attq, self.R, trans.euler_from_quaternion(self.attq), self.stab_att,
+                                      self.timings.last())
+                log_done  = time.perf_counter()
+                overshoot = self.scheduler.wait()
+
+                # the period is longer while the scheduler degrades
+                self.dt = self.scheduler.period()
+
+                self.timings.record(tick_start,
+                                    command_done  - tick_start,
+                                    control_done  - command_done,
+                                    setpoint_done - control_done,
+                                    log_done      - setpoint_done,
+                                    overshoot)
 
     def calc_control_signals(self):
         roll, pitch, yaw  = trans.euler_from_quaternion(self.attq)
@@ -348,14 +367,6 @@ class ControllerThread(Thread):
         self.ey_int = 0
         self.ez_int = 0
 
-    def loop_sleep(self, time_start):
-        """ Sleeps the control loop to make it run at a specified rate """
-        delta_time = 1e-3*self.period_in_ms - (time.time() - time_start)
-        if delta_time > 0:
-            time.sleep(delta_time)
-        else:
-            print('Deadline missed by', -delta_time, 'seconds. Too slow control loop!')
-
     def increase_thrust(self):
         self.thrust_r += self.thrust_step
         self.thrust_r = min(self.thrust_r, 0xffff)
@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+
+# Incremental replanning with D* Lite (Koenig and Likhachev, "D* Lite"), on the
+# flat grid of a path.Scene. The search runs backwards from the target, so that
+# the costs to get from any cell to the target stay valid when the crazyflie
+# moves on. When obstacles are added to or removed from the scene, only the
+# cells whose costs change are updated, instead of planning from scratch.
+
+import numpy as np
+
+from heap import IndexedHeap
+from math import inf, sqrt
+from path import PathUnreachable, PlanningTimeout
+from time import perf_counter
+
+class DStarLite():
+    # keys that differ by less than this only differ by rounding
+    tolerance = 1e-9
+
+    def __init__(self, scene, start, target, minClearance = 0.0):
+        self.scene        = scene
+        self.minClearance = minClearance
+        self.grid         = scene.grid(minClearance)
+        self.target       = target
+
+        grid = self.grid
+
+        self.start = grid.index(scene.freeCell(start,  "Start",  grid, minClearance))
+        self.goal  = grid.index(scene.freeCell(target, "Target", grid, minClearance))
+
+        # the blocked cells that the current costs are based on, and how many of
+        # the changes of the grid they include
+        self.blocked = grid.blocked.copy()
+        self.seen    = len(grid.changes)
+
+        # the cheapest known costs from the cells to the goal (g) and the
+        # one-step lookahead values (rhs)
+        self.costs     = np.full(len(self.blocked), np.inf)
+        self.lookahead = np.full(len(self.blocked), np.inf)
+
+        # the arrays are only accessed element by element, which is much faster
+        # through memoryviews
+        self.g, self.rhs, self.known = [memoryview(a) for a in [self.costs, self.lookahead, self.blocked]]
+
+        self.steps = list(zip(grid.offsets.tolist(), grid.stepCosts.tolist()))
+
+        # the cells whose g and rhs differ, queued by their keys
+        self.queue = IndexedHeap()
+        self.km    = 0.0
+
+        self.rhs[self.goal] = 0.0
+        self.queue.push(self.goal, (self.heuristic(self.start, self.goal), 0.0))
+
+        # the number of cells expanded by the last replanning
+        self.lastExpansions = 0
+
+    def __repr__(self):
+        return "<DStarLite:{}->{}>".format(self.grid.cell(self.start), self.grid.cell(self.goal))
+
+    # the distance between the middles of two cells, in meters
+    def heuristic(self, a, b):
+        sx, sy = self.grid.strides
+
+        xa, rest = divmod(a, sx)
+        ya, za   = divmod(rest, sy)
+        xb, rest = divmod(b, sx)
+        yb, zb   = divmod(rest, sy)
+
+        return self.grid.resolution * sqrt((xa - xb) ** 2 + (ya - yb) ** 2 + (za - zb) ** 2)
+
+    def key(self, cell):
+        m = min(self.g[cell], self.rhs[cell])
+        return (m + self.heuristic(self.start, cell) + self.km, m)
+
+    # Whether key a comes before key b. Keys that only differ by rounding count
+    # as equal, and equal keys are expanded as well: stopping at them could
+    # leave cells along the path inconsistent.
+    def keyBefore(self, a, b):
+        if abs(a[0] - b[0]) > self.tolerance:
+            return a[0] < b[0]
+
+        return a[1] <= b[1] + self.tolerance
+
+    # Recomputes the rhs value of a cell from its neighbours.
+    def updateLookahead(self, cell):
+        if cell == self.goal:
+            return
+
+        g, known = self.g, self.known
+        best     = inf
+
+        if not known[cell]:
+            for offset, stepCost in self.steps:
+                neighbour = cell + offset
+
+                if not known[neighbour] and stepCost + g[neighbour] < best:
+                    best = stepCost + g[neighbour]
+
+        self.rhs[cell] = best
+
+    # Queues a cell if it is inconsistent, with its current key, and removes it
+    # from the queue otherwise.
+    def updateQueue(self, cell):
+        if self.g[cell] != self.rhs[cell]:
+            if cell in self.queue:
+                self.queue.update(cell, self.key(cell))
+            else:
+                self.queue.push(cell, self.key(cell))
+
+        elif cell in self.queue:
+            self.queue.remove(cell)
+
+    # Expands inconsistent cells until the costs from start are known. When the
+    # cost of a cell drops, the rhs values of its neighbours can only drop as
+    # well, so they do not have to be recomputed from all of their neighbours.
+    #
+    # Every expansion leaves the queue in a consistent state, so when the
+    # deadline passes, the search stops with a PlanningTimeout and can be
+    # continued later.
+    def computeShortestPath(self, deadline = inf):
+        queue, g, rhs, known = self.queue, self.g, self.rhs, self.known
+        expansions           = 0
+
+        while not queue.isEmpty() and (self.keyBefore(queue.peekMin()[1], self.key(self.start)) or rhs[self.start] != g[self.start]):
+            cell, oldKey = queue.peekMin()
+            newKey       = self.key(cell)
+            expansions  += 1
+
+            # give up if planning takes too long
+            if expansions & 1023 == 0 and perf_counter() > deadline:
+                self.lastExpansions = expansions
+                raise PlanningTimeout("Planning took longer than allowed!")
+
+            if oldKey < newKey:
+                queue.update(cell, newKey)
+
+            elif g[cell] > rhs[cell]:
+                g[cell] = cost = rhs[cell]
+                queue.remove(cell)
+
+                for offset, stepCost in self.steps:
+                    neighbour = cell + offset
+
+                    if not known[neighbour] and cost + stepCost < rhs[neighbour] and neighbour != self.goal:
+                        rhs[neighbour] = cost + stepCost
+                        self.updateQueue(neighbour)
+
+            else:
+                oldCost = g[cell]
+                g[cell] = inf
+
+                # only the neighbours whose rhs values came from this cell
+                for offset, stepCost in self.steps:
+                    neighbour = cell + offset
+
+                    if not known[neighbour] and rhs[neighbour] == oldCost + stepCost:
+                        self.updateLookahead(neighbour)
+                        self.updateQueue(neighbour)
+
+                self.updateLookahead(cell)
+                self.updateQueue(cell)
+
+        self.lastExpansions = expansions
+
+    # Whether the scene still updates the grid of the planner. It drops the
+    # grids of clearances that were not used for a while.
+    def isCurrent(self):
+        return self.scene.flatGrids.get(self.scene.roundClearance(self.minClearance)) is self.grid
+
+    # Moves the start of the path to the given point, e.g. the position that the
+    # crazyflie has reached.
+    def moveTo(self, point):
+        start = self.grid.index(self.scene.freeCell(point, "Start", self.grid, self.minClearance))
+
+        self.km   += self.heuristic(self.start, start)
+        self.start = start
+
+    # Takes over the cells of the scene that changed since the last time. Only
+    # the ranges that the scene reported as changed are compared, not the whole
+    # grid.
+    def applyChanges(self):
+        changes = self.grid.changes[self.seen:]
+
+        if not changes:
+            return
+
+        self.seen += len(changes)
+
+        sx, sy  = self.grid.strides
+        changed = []
+
+        for ranges in changes:
+            # the indices of the cells in the ranges, shifted by the padding
+            xs, ys, zs = [np.arange(r.start + 1, r.stop + 1) for r in ranges]
+            cells      = (xs[:, None, None] * sx + ys[None, :, None] * sy + zs[None, None, :]).reshape(-1)
+
+            changed.append(cells[self.blocked[cells] != self.grid.blocked[cells]])
+
+        changed               = np.unique(np.concatenate(changed))
+        self.blocked[changed] = self.grid.blocked[changed]
+
+        # the costs of all steps into and out of the changed cells changed
+        affected = set()
+
+        for cell in changed.tolist():
+            affected.add(cell)
+            affected.update(cell + offset for offset, _ in self.steps)
+
+        for cell in affected:
+            if 0 <= cell < len(self.blocked):
+                self.updateLookahead(cell)
+                self.updateQueue(cell)
+
+    # Plans, or repairs, the path from the current start to the target and
+    # returns the grid cells along it. Raises a PathUnreachable if there is no
+    # path (any more), e.g. because the start or the target got blocked, and a
+    # PlanningTimeout if planning takes longer than timeout seconds.
+    def planCells(self, timeout = None):
+        self.applyChanges()
+
+        for role, cell in [("Start", self.start), ("Target", self.goal)]:
+            if self.known[cell]:
+                raise PathUnreachable("{} {} is blocked by an obstacle!".format(role, self.scene.getPoint(self.grid.cell(cell))))
+
+        self.computeShortestPath(inf if timeout is None else perf_counter() + timeout)
+
+        if self.g[self.start] == inf:
+            raise PathUnreachable("Cannot find a path to target!")
+
+        cell    = self.start
+        path    = [cell]
+        visited = {cell}
+
+        while cell != self.goal:
+            best, successor = inf, None
+
+            for offset, stepCost in self.steps:
+                neighbour = cell + offset
+
+                if not self.known[neighbour] and stepCost + self.g[neighbour] < best:
+                    best, successor = stepCost + self.g[neighbour], neighbour
+
+            # the costs must lead to the goal without visiting a cell twice,
+            # otherwise following them would never end
+            if successor is None or successor in visited:
+                raise Exception("The costs of cell {} do not lead to the target!".format(self.grid.cell(cell)))
+
+            cell = successor
+            path.append(cell)
+            visited.add(cell)
+
+        return [self.grid.cell(i) for i in path]
+
+    # Same as planCells, but returns the path like Scene.planPath.
+    def planPath(self, smooth = False, timeout = None):
+        path = self.scene.pathFromCells(self.planCells(timeout), self.target)
+
+        if smooth:
+            path = self.scene.smoothPath(path, self.minClearance)
+
+        return self.scene.postprocessPath(path)
+
+
+if __name__ == '__main__':
+    from path import Point, Scene, Translate, Scale, Cube
+
+    # the scene of the path planning server
+    table1   = Translate(Scale(Cube(), 1.30, 0.65, 0.75), 1.35, 0.68, 0.00)
+    table2   = Translate(Scale(Cube(), 1.30, 0.65, 0.75), 1.35, 2.68, 0.00)
+    obstacle = Translate(Scale(Cube(), 1.60, 0.8, 2.20), 1.25, 1.70, 0.00)
+    scene    = Scene(4.0, 4.0, 2.6, 0.1, [table1, table2, obstacle])
+
+    scene.debug = False
+    start       = Point(0.2, 0.2, 1.0)
+    target      = Point(3.8, 3.8, 1.2)
+
+    planningStart = perf_counter()
+    planner       = DStarLite(scene, start, target)
+    path          = planner.planPath()
+    print("initial plan:  {:7.1f} ms, {:6d} expansions".format(1000 * (perf_counter() - planningStart), planner.lastExpansions))
+
+    # somebody walks into the room, halfway along the path
+    person = Translate(Scale(Cube(), 0.5, 0.5, 1.8), path[len(path) // 2].x - 0.25, path[len(path) // 2].y - 0.25, 0.00)
+
+    for change in [scene.addObstacle, scene.removeObstacle]:
+        planningStart = perf_counter()
+        change(person)
+        changeTime    = perf_counter() - planningStart
+
+        planningStart = perf_counter()
+        planner.planPath()
+        repairTime    = perf_counter() - planningStart
+        repairs       = planner.lastExpansions
+
+        planningStart = perf_counter()
+        scene.planPath(start, target)
+        replanTime    = perf_counter() - planningStart
+
+        print("{:14s} {:7.1f} ms, repair {:7.1f} ms, {:6d} expansions (A* from scratch: {:7.1f} ms, {:6d} expansions)".format(
+            change.__name__ + ":", 1000 * changeTime, 1000 * repairTime, repairs, 1000 * replanTime, scene.lastExpansions))
@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+# The flight log of the controller thread, in a binary format.
+#
+# A flight log file starts with a header of 16 bytes (magic, version and the
+# size of a record) followed by fixed-width records, one per control period.
+# Every record holds the same fields as the CSV files that were written
+# before, as float64 values in this order, and since version 2 also the
+# timings of the previous control period. FlightLog reads such a file without
+# loading it into memory.
+
+import numpy as np
+import struct
+import sys
+
+from queue     import Empty, Queue
+from threading import Lock, Thread
+from time      import monotonic
+
+# the fields of a record and their shapes
+schema = [ ("time",     ())
+         , ("setpoint", (4,))   # roll, pitch, yaw rate, thrust
+         , ("pos_ref",  (3,))
+         , ("yaw_ref",  ())
+         , ("pos",      (3,))
+         , ("vel",      (3,))
+         , ("attq",     (4,))
+         , ("R",        (3, 3))
+         , ("euler",    (3,))   # roll, pitch, yaw from attq
+         , ("stab_att", (3,))
+         , ("timings",  (6,))   # the phases of timing.py, in seconds
+         ]
+
+record = np.dtype([(name, "<f8", shape) for name, shape in schema])
+
+header  = struct.Struct("<8sII")
+magic   = b"CFLOG\0\0\0"
+version = 2
+
+# the records of all versions that can be read
+records = { 1 : np.dtype([(name, "<f8", shape) for name, shape in schema[:-1]])
+          , 2 : record
+          }
+
+# Checks the header of a flight log file and returns its size in bytes and the
+# type of its records.
+def readHeader(fh):
+    data = fh.read(header.size)
+
+    if len(data) < header.size:
+        raise Exception("Not a flight log: {}".format(fh.name))
+
+    fileMagic, fileVersion, recordSize = header.unpack(data)
+
+    if fileMagic != magic:
+        raise Exception("Not a flight log: {}".format(fh.name))
+
+    if fileVersion not in records or recordSize != records[fileVersion].itemsize:
+        raise Exception("Unsupported flight log version {} with records of {} bytes!".format(fileVersion, recordSize))
+
+    return (header.size, records[fileVersion])
+
+
+# Writes the flight log without slowing down the control loop. Rows are
+# written into preallocated chunks, and full chunks are written to the file by
+# a background thread. A chunk that is not full yet is handed over after
+# flushInterval seconds anyway, so that at most that much of the log is lost
+# when the program is killed. The writer thread also hands it over when no rows
+# are appended any more, e.g. while the motors are disabled, so the rows are
+# written even if the log is never closed.
+class FlightLogWriter():
+    def __init__(self, fileName, rowsPerChunk = 256, flushInterval = 1.0, chunks = 4):
+        self.fileName      = fileName
+        self.rowsPerChunk  = rowsPerChunk
+        self.flushInterval = flushInterval
+
+        # the current chunk is handed over by the thread that appends rows and
+        # by the writer thread
+        self.lock = Lock()
+
+        # the chunks that can be filled, and the ones that should be written
+        self.free    = Queue()
+        self.written = Queue()
+
+        for _ in range(chunks):
+            self.free.put(np.zeros(rowsPerChunk, dtype = record))
+
+        self.__takeChunk__()
+
+        self.fh = open(fileName, 'wb')
+        self.fh.write(header.pack(magic, version, record.itemsize))
+        self.fh.flush()
+
+        self.writer        = Thread(target = self.__writeChunks__)
+        self.writer.daemon = True
+        self.writer.start()
+
+    def __repr__(self):
+        return "<FlightLogWriter:{}>".format(self.fileName)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    # Adds a row to the log, with one value for every field of the schema,
+    # e.g. append(time, setpoint, pos_ref, yaw_ref, pos, vel, attq, R, euler, stab_att, timings).
+    def append(self, *values):
+        with self.lock:
+            for column, value in zip(self.columns, values):
+                column[self.filled] = value
+
+            self.filled += 1
+
+            if self.filled == self.rowsPerChunk or monotonic() - self.handedOver > self.flushInterval:
+                self.__handOver__()
+
+    # hands the rows so far over to the writer thread
+    def flush(self):
+        with self.lock:
+            self.__handOver__()
+
+    # writes the remaining rows and closes the file
+    def close(self):
+        self.flush()
+        self.written.put(None)
+        self.writer.join()
+        self.fh.close()
+
+    # "internal" method that hands the rows so far over to the writer thread,
+    # with the lock held
+    def __handOver__(self):
+        if self.filled > 0:
+            self.written.put((self.chunk, self.filled))
+            self.__takeChunk__()
+
+    # "internal" method to continue with an empty chunk. If the writer thread
+    # is behind and there is no free chunk, another one is allocated instead of
+    # waiting.
+    def __takeChunk__(self):
+        try:
+            self.chunk = self.free.get_nowait()
+        except Empty:
+            self.chunk = np.zeros(self.rowsPerChunk, dtype = record)
+
+        self.columns    = [self.chunk[name] for name, _ in schema]
+        self.filled     = 0
+        self.handedOver = monotonic()
+
+    # "internal" method of the writer thread
+    def __writeChunks__(self):
+        while True:
+            try:
+                item = self.written.get(timeout = self.flushInterval)
+            except Empty:
+                # nothing was handed over for a while, so the rows that were
+                # appended in the meantime are taken from the current chunk
+                with self.lock:
+                    if monotonic() - self.handedOver >= self.flushInterval:
+                        self.__handOver__()
+
+                continue
+
+            if item is None:
+                break
+
+            chunk, filled = item
+
+            self.fh.write(memoryview(chunk[:filled]).cast('B'))
+            self.fh.flush()
+            self.free.put(chunk)
+
+
+# Reads a flight log file without loading it. The records are memory-mapped,
+# so opening even a log of several hours is instant, and only the parts of the
+# file that are accessed are read. Every field is available as a numpy view of
+# the file, e.g. log["pos"] has the shape (len(log), 3).
+#
+# The records are ordered by time, so a time range is found by binary search
+# on the time column, e.g. log.between(60.0, 120.0) for the second minute.
+class FlightLog():
+    def __init__(self, fileName, records = None):
+        self.fileName = fileName
+
+        if records is None:
+            with open(fileName, 'rb') as fh:
+                offset, recordType = readHeader(fh)
+                fh.seek(0, 2)
+
+                # a record that was not written completely is ignored
+                count = (fh.tell() - offset) // recordType.itemsize
+
+            if count > 0:
+                records = np.memmap(fileName, dtype = recordType, mode = 'r', offset = offset, shape = (count,))
+            else:
+                records = np.empty(0, dtype = recordType)
+
+        self.records = records
+
+    def __repr__(self):
+        return "<FlightLog:{}:{}>".format(self.fileName, len(self))
+
+    def __len__(self):
+        return len(self.records)
+
+    # returns the view of a field, or a part of the log for an index or a slice
+    def __getitem__(self, key):
+        if isinstance(key, str):
+            return self.records[key]
+
+        return FlightLog(self.fileName, self.records[key])
+
+    # the names of the fields
+    def columns(self):
+        return list(self.records.dtype.names)
+
+    # the time of the first and the last record, in seconds
+    def timeRange(self):
+        if len(self) == 0:
+            return (None, None)
+
+        times = self.records["time"]
+        return (float(times[0]), float(times[-1]))
+
+    # Returns the part of the log from start (inclusive) to stop (exclusive),
+    # in seconds since the start of the flight, without copying. Either of them
+    # can be None for an open range.
+    def between(self, start = None, stop = None):
+        times = self.records["time"]
+        first = 0         if start is None else int(np.searchsorted(times, start, side = 'left'))
+        last  = len(self) if stop  is None else int(np.searchsorted(times, stop,  side = 'left'))
+
+        return self[first:last]
+
+    # returns the values of all fields as a matrix with one row per record
+    def toArray(self):
+        return np.ascontiguousarray(self.records).view(np.float64).reshape(len(self), -1)
+
+
+# Converts a flight log file to CSV, with one column per value and the names of
+# the columns in the first line, e.g. pos_ref[0] or R[1][2]. Optionally, only
+# the records between start and stop (in seconds) are converted.
+def toCsv(logFileName, csvFileName, start = None, stop = None):
+    log   = FlightLog(logFileName).between(start, stop)
+    names = []
+
+    for name in log.columns():
+        shape = log.records.dtype[name].shape
+
+        if shape:
+            names += [name + "".join("[{}]".format(i) for i in index) for index in np.ndindex(*shape)]
+        else:
+            names.append(name)
+
+    np.savetxt(csvFileName, log.toArray(), fmt = "%.10g", delimiter = ",", header = ",".join(names), comments = "")
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: {} flightlog.bin [flightlog.csv [start stop]]".format(sys.argv[0]))
+        sys.exit(1)
+
+    logFileName = sys.argv[1]
+    csvFileName = sys.argv[2] if len(sys.argv) > 2 else logFileName.rsplit('.', 1)[0] + '.csv'
+    start, stop = [float(t) for t in sys.argv[3:5]] if len(sys.argv) > 4 else (None, None)
+
+    toCsv(logFileName, csvFileName, start, stop)
+    print("Wrote {}".format(csvFileName))
@@ -0,0 +1,208 @@
+#!/usr/bin/env python3
+
+# A mutable priority queue, implemented as an indexed binary heap.
+# In contrast to the (persistent) red black tree, the heap is changed in place
+# and keeps track of the position of every item in the heap. Therefore, the
+# priority of an item that is already queued can be changed (decrease-key)
+# instead of inserting the item a second time.
+#
+# Items must be hashable and priorities must be comparable. Items with equal
+# priorities are retrieved in the order in which they were pushed.
+
+class IndexedHeap():
+    def __init__(self):
+        self.items     = []  # the items, in heap order
+        self.keys      = []  # (priority, insertion number) for every item in self.items
+        self.positions = {}  # the position of every item in self.items
+        self.pushed    = 0   # the number of pushed items, to break ties
+
+    def __repr__(self):
+        return "<IndexedHeap:{}>".format(len(self.items))
+
+    def __len__(self):
+        return len(self.items)
+
+    def __contains__(self, item):
+        return item in self.positions
+
+    # checks whether the heap is empty
+    def isEmpty(self):
+        return not self.items
+
+    # returns the priority of a queued item
+    def priority(self, item):
+        return self.keys[self.positions[item]][0]
+
+    # Adds a new item with the given priority to the heap.
+    # O(log(n))
+    def push(self, item, priority):
+        if item in self.positions:
+            raise Exception("Item {} is already queued!".format(item))
+
+        self.items.append(item)
+        self.keys.append((priority, self.pushed))
+        self.positions[item] = len(self.items) - 1
+        self.pushed         += 1
+
+        self.__siftUp__(len(self.items) - 1)
+
+    # Lowers the priority of a queued item.
+    # O(log(n))
+    def decreaseKey(self, item, priority):
+        i = self.positions[item]
+
+        if self.keys[i][0] < priority:
+            raise Exception("Cannot increase the priority of {} with decreaseKey!".format(item))
+
+        self.keys[i] = (priority, self.keys[i][1])
+        self.__siftUp__(i)
+
+    # Pushes the item if it is not queued yet, or lowers its priority if the
+    # given priority is better than the queued one. Returns whether the heap
+    # was changed.
+    # O(log(n))
+    def pushOrDecrease(self, item, priority):
+        i = self.positions.get(item)
+
+        if i is None:
+            self.push(item, priority)
+            return True
+
+        if priority < self.keys[i][0]:
+            self.keys[i] = (priority, self.keys[i][1])
+            self.__siftUp__(i)
+            return True
+
+        return False
+
+    # Changes the priority of a queued item in either direction.
+    # O(log(n))
+    def update(self, item, priority):
+        i            = self.positions[item]
+        self.keys[i] = (priority, self.keys[i][1])
+
+        self.__siftUp__(i)
+        self.__siftDown__(self.positions[item])
+
+    # returns the item with the lowest priority and its priority without
+    # removing it from the heap
+    def peekMin(self):
+        if not self.items:
+            raise Exception("Empty heap!")
+
+        return (self.items[0], self.keys[0][0])
+
+    # returns the item with the lowest priority and its priority and removes it
+    # from the heap
+    # O(log(n))
+    def popMin(self):
+        if not self.items:
+            raise Exception("Empty heap!")
+
+        item, key = self.items[0], self.keys[0]
+        self.__removeAt__(0)
+
+        return (item, key[0])
+
+    # removes a queued item from the heap
+    # O(log(n))
+    def remove(self, item):
+        self.__removeAt__(self.positions[item])
+
+    # "internal" method to remove the item at position i by replacing it with
+    # the last item in the heap
+    def __removeAt__(self, i):
+        item     = self.items[i]
+        lastItem = self.items.pop()
+        lastKey  = self.keys.pop()
+
+        del self.positions[item]
+
+        if i < len(self.items):
+            self.items[i]            = lastItem
+            self.keys[i]             = lastKey
+            self.positions[lastItem] = i
+
+            self.__siftUp__(i)
+            self.__siftDown__(self.positions[lastItem])
+
+    # "internal" method to move the item at position i up until its parent has
+    # a lower priority
+    def __siftUp__(self, i):
+        items, keys, positions = self.items, self.keys, self.positions
+
+        item, key = items[i], keys[i]
+
+        while i > 0:
+            parent = (i - 1) >> 1
+
+            if not key < keys[parent]:
+                break
+
+            items[i]            = items[parent]
+            keys[i]             = keys[parent]
+            positions[items[i]] = i
+            i                   = parent
+
+        items[i]        = item
+        keys[i]         = key
+        positions[item] = i
+
+    # "internal" method to move the item at position i down until its children
+    # have higher priorities
+    def __siftDown__(self, i):
+        items, keys, positions = self.items, self.keys, self.positions
+
+        n         = len(items)
+        item, key = items[i], keys[i]
+
+        while True:
+            child = 2 * i + 1
+
+            if child >= n:
+                break
+
+            if child + 1 < n and keys[child + 1] < keys[child]:
+                child += 1
+
+            if not keys[child] < key:
+                break
+
+            items[i]            = items[child]
+            keys[i]             = keys[child]
+            positions[items[i]] = i
+            i                   = child
+
+        items[i]        = item
+        keys[i]         = key
+        positions[item] = i
+
+
+if __name__ == '__main__':
+    from random import randint
+
+    h = IndexedHeap()
+    d = {}
+
+    for x in range(1000):
+        d[x] = randint(0, 100)
+        h.push(x, d[x])
+
+    for x in range(0, 1000, 3):
+        d[x] = d[x] - randint(0, 50)
+        h.decreaseKey(x, d[x])
+
+    for x in range(1, 1000, 7):
+        d[x] = randint(0, 200)
+        h.update(x, d[x])
+
+    for x in range(2, 1000, 11):
+        h.remove(x)
+        d.pop(x)
+
+    while not h.isEmpty():
+        shouldBeMin = min(d.values())
+        m, p = h.popMin()
+
+        if p != shouldBeMin or d.pop(m) != p:
+            raise Exception("Wrong minimum, should be {} but is {}!".format(shouldBeMin, p))
@@ -7,14 +7,34 @@
 # Author: Christopher Blöcker
 
 import numpy as np
+import os
 
-from abc      import ABC, abstractmethod
-from redblack import *
+from collections        import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing    import shared_memory
+
+from abc       import ABC, abstractmethod
+from functools import lru_cache
+from hashlib   import sha256
+from heap      import IndexedHeap
+from heapq     import heappush, heappop
+from itertools import product
+from math      import ceil, floor, inf, sqrt
+from threading import Lock, RLock, local
+from time      import perf_counter
 
 # functions for tuple projections
 fst = lambda p: p[0]
 snd = lambda p: p[1]
 
+# the 26 directions from a grid cell to its neighbours
+neighbourDirections = [ (dx, dy, dz)
+                        for dx in [-1, 0, 1]
+                        for dy in [-1, 0, 1]
+                        for dz in [-1, 0, 1]
+                        if (dx, dy, dz) != (0, 0, 0)
+                      ]
+
 # A 3D point.
 class Point():
     def __init__(self, x, y , z):
@@ -51,6 +71,30 @@ class Object(ABC):
     def contains(self, point):
         raise Exception("contains not implemented.")
 
+    # Checks for each row of an (M, 3) array of points whether it lies within
+    # the object and returns an array of M booleans. Objects that can do better
+    # than testing the points one by one should override this.
+    def containsPoints(self, points):
+        return np.array( [self.contains(Point(x, y, z)) for (x, y, z) in points]
+                       , dtype = bool
+                       )
+
+    # Returns the axis-aligned bounding box of the object as a pair of arrays
+    # (lower, upper), or None if the object cannot tell.
+    def boundingBox(self):
+        return None
+
+    # Checks whether the object is exactly its bounding box, i.e. whether it is
+    # an axis-aligned box.
+    def isBox(self):
+        return False
+
+    # Returns a string that determines the shape and position of the object
+    # completely, or None if the object cannot tell. Scenes use it to recognise
+    # obstacles they have rasterized before.
+    def describe(self):
+        return None
+
 
 # Scales an object according to the given scaling factors in x-, y-, and z-direction.
 class Scale(Object):
@@ -70,6 +114,36 @@ class Scale(Object):
 
         return self.scaledObject.contains(scaledPoint)
 
+    # Same as contains, but for an (M, 3) array of points.
+    def containsPoints(self, points):
+        return self.scaledObject.containsPoints(points / [self.scaleX, self.scaleY, self.scaleZ])
+
+    # Scales the corners of the bounding box of the scaled object. Negative
+    # scaling factors swap the corners.
+    def boundingBox(self):
+        box = self.scaledObject.boundingBox()
+
+        if box is None:
+            return None
+
+        factors = [self.scaleX, self.scaleY, self.scaleZ]
+        lower   = box[0] * factors
+        upper   = box[1] * factors
+
+        return (np.minimum(lower, upper), np.maximum(lower, upper))
+
+    # Scaling along the axes keeps boxes axis-aligned.
+    def isBox(self):
+        return self.scaledObject.isBox()
+
+    def describe(self):
+        inner = self.scaledObject.describe()
+
+        if inner is None:
+            return None
+
+        return "Scale({}, {!r}, {!r}, {!r})".format(inner, self.scaleX, self.scaleY, self.scaleZ)
+
 
 # Translates an object according to the given translations in x-, y-, and z-direction.
 class Translate(Object):
@@ -89,6 +163,32 @@ class Translate(Object):
 
         return self.translatedObject.contains(translatedPoint)
 
+    # Same as contains, but for an (M, 3) array of points.
+    def containsPoints(self, points):
+        return self.translatedObject.containsPoints(points - [self.translateX, self.translateY, self.translateZ])
+
+    # Translates the bounding box of the translated object.
+    def boundingBox(self):
+        box = self.translatedObject.boundingBox()
+
+        if box is None:
+            return None
+
+        offset = [self.translateX, self.translateY, self.translateZ]
+
+        return (box[0] + offset, box[1] + offset)
+
+    def isBox(self):
+        return self.translatedObject.isBox()
+
+    def describe(self):
+        inner = self.translatedObject.describe()
+
+        if inner is None:
+            return None
+
+        return "Translate({}, {!r}, {!r}, {!r})".format(inner, self.translateX, self.translateY, self.translateZ)
+
 
 # A unit cube.
 class Cube(Object):
@@ -102,13 +202,593 @@ class Cube(Object):
            and 0 <= point.y <= 1 \
            and 0 <= point.z <= 1
 
+    # Same as contains, but for an (M, 3) array of points.
+    def containsPoints(self, points):
+        return np.all((0 <= points) & (points <= 1), axis = 1)
+
+    def boundingBox(self):
+        return (np.zeros(3), np.ones(3))
+
+    def isBox(self):
+        return True
+
+    def describe(self):
+        return "Cube()"
+
+
+# A 3D grid of occupied and free cells that stores one bit per cell. The bits
+# are packed along the z-axis, so every (x, y) column of the grid is a row of
+# bytes. Reading and writing regions unpacks only the bytes that cover them.
+#
+# Note that the searches do not run on the bits: they use the padded Grid with
+# one byte per cell, and arrays of costs and predecessors for every cell, so
+# planning still needs at least 13 bytes per cell.
+class OccupancyGrid():
+    def __init__(self, shape, bits = None):
+        self.shape = tuple(shape)
+
+        if bits is None:
+            bits = np.zeros(self.shape[:2] + ((self.shape[2] + 7) // 8,), dtype = np.uint8)
+
+        self.bits = bits
+
+    def __repr__(self):
+        return "<OccupancyGrid:{}x{}x{}>".format(*self.shape)
+
+    # The occupancy of a single cell (x, y, z) as a bool, or of a region given
+    # by slices as a bool array.
+    def __getitem__(self, index):
+        x, y, z = index
+
+        if isinstance(z, slice):
+            return self.region((x, y, z))
+
+        return bool((self.bits[x, y, z >> 3] >> (z & 7)) & 1)
+
+    # Marks a region given by slices as occupied (True) or free (False).
+    def __setitem__(self, index, value):
+        if value is True:
+            self.fill(index)
+        elif value is False:
+            self.clear(index)
+        else:
+            raise Exception("Cells can only be marked as occupied or free, not as {}!".format(value))
+
+    # The occupancy of a region given by slices (with steps of 1) as a bool array.
+    def region(self, ranges):
+        xs, ys, zs = [slice(*r.indices(n)[:2]) for r, n in zip(ranges, self.shape)]
+
+        first, last = zs.start >> 3, (zs.stop + 7) >> 3
+        unpacked    = np.unpackbits(self.bits[xs, ys, first:last], axis = 2, bitorder = "little")
+        offset      = zs.start - (first << 3)
+
+        return unpacked[:, :, offset : offset + max(0, zs.stop - zs.start)].view(bool)
+
+    # Marks the cells within a region given by slices as occupied. If a mask
+    # with the shape of the region is given, only the cells where the mask is
+    # True are marked.
+    def fill(self, ranges, mask = None, value = 1):
+        xs, ys, zs = [slice(*r.indices(n)[:2]) for r, n in zip(ranges, self.shape)]
+
+        if xs.stop <= xs.start or ys.stop <= ys.start or zs.stop <= zs.start:
+            return
+
+        first, last = zs.start >> 3, (zs.stop + 7) >> 3
+        unpacked    = np.unpackbits(self.bits[xs, ys, first:last], axis = 2, bitorder = "little")
+        offset      = zs.start - (first << 3)
+        window      = unpacked[:, :, offset : offset + zs.stop - zs.start]
+
+        if mask is None:
+            window[...] = value
+        else:
+            window[mask] = value
+
+        self.bits[xs, ys, first:last] = np.packbits(unpacked, axis = 2, bitorder = "little")
+
+    # Marks the cells within a region given by slices as free.
+    def clear(self, ranges):
+        self.fill(ranges, value = 0)
+
+    # the whole grid as a bool array
+    def toArray(self):
+        return self.region((slice(None), slice(None), slice(None)))
+
+
+# The grid of a scene in a form that is suitable for fast searches: grid cells
+# are identified by linear indices into flat arrays. The grid is padded with a
+# layer of blocked cells on all sides, so that searches never have to check
+# whether a neighbour of a cell lies within the bounds of the scene.
+#
+# Instead of the occupied cells, the padded array itself can be given, e.g. to
+# use one that lies in shared memory. It is used as it is, without a copy.
+class Grid():
+    def __init__(self, occupied, resolution, padded = None):
+        if padded is None:
+            padded = np.pad(np.asarray(occupied, dtype = bool), 1, constant_values = True)
+
+        self.shape      = tuple(n - 2 for n in padded.shape)
+        self.resolution = resolution
+        self.occupied   = padded[1:-1, 1:-1, 1:-1]
+
+        # the distances between neighbouring cells in x- and y-direction
+        self.strides = (padded.shape[1] * padded.shape[2], padded.shape[2])
+
+        # blocked cells are obstacles and the padding around the scene
+        self.paddedShape = padded.shape
+        self.blocked     = padded.reshape(-1)
+
+        # Everything below is built when it is needed for the first time, under
+        # this lock, as grids are shared by the threads of the server.
+        # forcedDirections only adds entries that are the same for every
+        # thread, so it gets along without the lock.
+        self.lock = Lock()
+
+        # for jump point search
+        self.neighbourMasks = None
+        self.natural        = None
+        self.forced         = {}
+
+        # coarser occupancies for hierarchical searches, for every factor that
+        # was asked for
+        self.pooled = {}
+
+        # the ranges of cells that were changed since the grid was built, in
+        # the order of the changes, see Scene.changed
+        self.changes = []
+
+        # the 26 directions to the neighbours of a cell, their offsets in the
+        # flat arrays and the costs for stepping into that direction
+        self.directions = np.array(neighbourDirections)
+        self.offsets    = self.directions @ [self.strides[0], self.strides[1], 1]
+        self.stepCosts  = resolution * np.sqrt((self.directions ** 2).sum(axis = 1))
+
+    # the linear index of a grid cell (x, y, z)
+    def index(self, cell):
+        return (cell[0] + 1) * self.strides[0] + (cell[1] + 1) * self.strides[1] + cell[2] + 1
+
+    # the grid cell (x, y, z) of a linear index
+    def cell(self, index):
+        x, rest = divmod(index, self.strides[0])
+        y, z    = divmod(rest,  self.strides[1])
+        return (x - 1, y - 1, z - 1)
+
+    # For every axis, a table with the squared distances from the middles of the
+    # (padded) grid cells along that axis to the given point. The heuristic for
+    # a cell (x, y, z) is then sqrt(tx[x + 1] + ty[y + 1] + tz[z + 1]).
+    def distanceTables(self, point):
+        tables = []
+
+        for n, p in zip(self.shape, [point.x, point.y, point.z]):
+            d = (np.arange(-1, n + 1) + 0.5) * self.resolution - p
+            tables.append(d * d)
+
+        return tables
+
+    # Checks whether the straight line between two points (in meters) only
+    # crosses free cells, with the voxel traversal by Amanatides and Woo, "A
+    # Fast Voxel Traversal Algorithm for Ray Tracing". Where the line passes
+    # exactly through an edge or a corner of cells, one of the cells next to it
+    # is visited as well, so the line never squeezes between blocked cells.
+    def lineOfSight(self, a, b):
+        return self.clearLine( [a.x / self.resolution, a.y / self.resolution, a.z / self.resolution]
+                             , [b.x / self.resolution, b.y / self.resolution, b.z / self.resolution]
+                             )
+
+    # Checks whether there is a line of sight between the middles of the cells
+    # with the given linear indices.
+    def visible(self, i, j):
+        sx, sy = self.strides
+
+        x, rest = divmod(i, sx)
+        y, z    = divmod(rest, sy)
+        p       = [x - 0.5, y - 0.5, z - 0.5]
+
+        x, rest = divmod(j, sx)
+        y, z    = divmod(rest, sy)
+        q       = [x - 0.5, y - 0.5, z - 0.5]
+
+        return self.clearLine(p, q)
+
+    # Same as lineOfSight, for points p and q given in cells, i.e. in units of
+    # the resolution.
+    def clearLine(self, p, q):
+        sx, sy  = self.strides
+        blocked = self.blocked
+
+        cell = [min(int(floor(c)), n - 1) for c, n in zip(p, self.shape)]
+        end  = [min(int(floor(c)), n - 1) for c, n in zip(q, self.shape)]
+
+        # for every axis, the direction of the steps, the fraction of the line
+        # at which the next cell boundary is crossed, and the fraction of the
+        # line between two boundaries
+        step   = [0, 0, 0]
+        tMax   = [inf, inf, inf]
+        tDelta = [inf, inf, inf]
+
+        for axis in range(3):
+            d = q[axis] - p[axis]
+
+            if d > 0:
+                step[axis]   = 1
+                tMax[axis]   = (cell[axis] + 1 - p[axis]) / d
+                tDelta[axis] = 1 / d
+            elif d < 0:
+                step[axis]   = -1
+                tMax[axis]   = (cell[axis] - p[axis]) / d
+                tDelta[axis] = -1 / d
+
+        x, y, z = cell
+
+        while True:
+            if blocked[(x + 1) * sx + (y + 1) * sy + z + 1]:
+                return False
+
+            if [x, y, z] == end:
+                return True
+
+            if tMax[0] <= tMax[1] and tMax[0] <= tMax[2]:
+                axis = 0
+            elif tMax[1] <= tMax[2]:
+                axis = 1
+            else:
+                axis = 2
+
+            # rounding kept us from hitting the cell of b exactly
+            if tMax[axis] > 1:
+                return True
+
+            if axis == 0:
+                x += step[0]
+            elif axis == 1:
+                y += step[1]
+            else:
+                z += step[2]
+
+            tMax[axis] += tDelta[axis]
+
+    # For every cell, a bit mask of its blocked neighbours: bit i is set if the
+    # neighbour in direction neighbourDirections[i] is blocked. Cells with a
+    # mask of 0 lie in open space.
+    def neighbourhoods(self):
+        masks = self.neighbourMasks
+
+        if masks is not None:
+            return masks
+
+        with self.lock:
+            if self.neighbourMasks is None:
+                blocked = np.pad(self.blocked.reshape(self.paddedShape), 1, constant_values = True)
+                masks   = np.zeros(self.paddedShape, dtype = np.uint32)
+                X, Y, Z = self.paddedShape
+
+                for i, (dx, dy, dz) in enumerate(neighbourDirections):
+                    masks |= blocked[1 + dx : 1 + dx + X, 1 + dy : 1 + dy + Y, 1 + dz : 1 + dz + Z].astype(np.uint32) << i
+
+                self.neighbourMasks = masks.reshape(-1)
+
+            return self.neighbourMasks
+
+    # The directions of the forced neighbours of a cell with the given mask of
+    # blocked neighbours when the cell is reached in direction d. There are only
+    # few different masks in a scene, so the results are remembered.
+    def forcedDirections(self, mask, d):
+        key = (mask << 5) | d
+
+        if key not in self.forced:
+            self.forced[key] = [ e
+                                 for e, paths in jumpPointRules()[d][1]
+                                 if not mask >> e & 1 and all(mask & path for path in paths)
+                               ]
+
+        return self.forced[key]
+
+    # The natural directions for every direction d according to jumpPointRules,
+    # with d itself first and the others sorted from long to short steps.
+    def naturalDirections(self):
+        with self.lock:
+            if self.natural is None:
+                self.natural = [ [d] + sorted( [e for e in natural if e != d]
+                                             , key = lambda e: -np.abs(self.directions[e]).sum()
+                                             )
+                                 for d, (natural, _) in enumerate(jumpPointRules())
+                               ]
+
+            return self.natural
+
+    # Drops everything that was derived from the blocked cells, after the cells
+    # in the given ranges changed.
+    def changed(self, ranges):
+        self.neighbourMasks = None
+        self.pooled         = {}
+
+        self.changes.append(ranges)
+
+    # The occupancy of the grid at a resolution that is coarser by the given
+    # factor. A coarse cell is occupied if any of the cells it covers is
+    # occupied (max-pooling), cells beyond the grid count as free.
+    def coarse(self, factor):
+        with self.lock:
+            if factor not in self.pooled:
+                shape  = [-(-n // factor) for n in self.shape]
+                padded = np.zeros([n * factor for n in shape], dtype = bool)
+
+                padded[tuple(slice(0, n) for n in self.shape)] = self.occupied
+
+                self.pooled[factor] = padded.reshape( shape[0], factor
+                                                    , shape[1], factor
+                                                    , shape[2], factor
+                                                    ).any(axis = (1, 3, 5))
+
+            return self.pooled[factor]
+
+
+# Grows the True cells of a 3D bool array by the given number of cells in all
+# 26 directions.
+def dilate(mask, radius):
+    for axis in range(mask.ndim):
+        grown = mask.copy()
+
+        for shift in range(1, radius + 1):
+            front = [slice(None)] * mask.ndim
+            back  = [slice(None)] * mask.ndim
+
+            front[axis] = slice(shift, None)
+            back[axis]  = slice(None, -shift)
+
+            grown[tuple(front)] |= mask[tuple(back)]
+            grown[tuple(back)]  |= mask[tuple(front)]
+
+        mask = grown
+
+    return mask
+
+
+# Scales a 3D bool array up by the given factor and crops it to the given shape.
+def upsample(mask, factor, shape):
+    for axis in range(mask.ndim):
+        mask = np.repeat(mask, factor, axis = axis)
+
+    return mask[tuple(slice(0, n) for n in shape)]
+
+
+# The pruning rules for jump point search on a 26-connected grid, derived from
+# the definition by Harabor and Grastien, "Online Graph Pruning for Pathfinding
+# on Grid Maps". When a cell x is reached from its parent p = x - d, we can
+# prune a neighbour n = x + e of x if there is another path from p to n that
+# does not go through x and is shorter, or is as long but takes the longer
+# steps first. Such paths stay in the neighbourhood of x. The neighbours that
+# can never be pruned are natural, they are the directions made up of the
+# components of d. The other neighbours are forced if all alternative paths are
+# blocked. Cells relative to x are given by their index in neighbourDirections.
+# Returns, for every direction d, the natural directions and a list of
+# (e, paths) for the neighbours that can be forced, where paths are bit masks
+# of the cells on the alternative paths. Neighbours that are adjacent to p are
+# never forced.
+@lru_cache(maxsize = None)
+def jumpPointRules():
+    cells    = neighbourDirections
+    sub      = lambda a, b: (a[0] - b[0], a[1] - b[1], a[2] - b[2])
+    adjacent = lambda a, b: a != b and max(abs(u - v) for u, v in zip(a, b)) <= 1
+
+    # the lengths of all steps between cells in the neighbourhood of x
+    steps    = list(product([-2, -1, 0, 1, 2], repeat = 3))
+    length   = {v : sqrt(sum(c * c for c in v)) for v in steps}
+    norm1    = {v : sum(abs(c) for c in v)      for v in steps}
+
+    # the cells that are adjacent to a cell, within the neighbourhood of x
+    neighbours = {a : {b for b in cells if adjacent(a, b)} for a in cells}
+
+    rules = []
+
+    for d in cells:
+        p       = tuple(-c for c in d)
+        natural = []
+        forced  = []
+
+        for e in cells:
+            if e == p:
+                continue
+
+            # the path through x, which takes the longer steps first if it is as
+            # long as the alternative
+            viaX   = length[d] + length[e]
+            orderX = (-norm1[d], -norm1[e])
+
+            others      = neighbours[p] - {e}
+            alternative = [()] if e in neighbours[p] else []
+            alternative += [(m,) for m in others & neighbours[e]]
+            alternative += [ (m1, m2)
+                             for m1 in others
+                             for m2 in (neighbours[m1] & neighbours[e]) - {p}
+                           ]
+
+            shorter = []
+
+            for path in alternative:
+                moves = [sub(b, a) for a, b in zip((p,) + path, path + (e,))]
+                l     = sum(length[move] for move in moves)
+                order = tuple(-norm1[move] for move in moves)
+
+                if l < viaX - 1e-9 or (abs(l - viaX) <= 1e-9 and order < orderX):
+                    shorter.append(set(path))
+
+            if not shorter:
+                natural.append(cells.index(e))
+
+            elif set() not in shorter:
+                # paths that contain all cells of another path are blocked if
+                # the other path is blocked, so we only need the minimal ones
+                minimal = [path for path in shorter if not any(other < path for other in shorter)]
+                masks   = {sum(1 << cells.index(c) for c in path) for path in minimal}
+
+                forced.append((cells.index(e), sorted(masks)))
+
+        rules.append((natural, forced))
+
+    return rules
+
+
+# The squared euclidean distance transform of an array along its last axis,
+# after Felzenszwalb and Huttenlocher, "Distance Transforms of Sampled
+# Functions": d[q] = min_p (q - p)^2 + f[p]. For every line, the lower envelope
+# of the parabolas rooted at the p is built from left to right and then sampled.
+# This is linear in the length of the lines, and all lines are handled at once.
+def squaredDistanceTransform1D(f):
+    lines, n = f.shape
+    rows     = np.arange(lines)
+
+    # the roots of the parabolas in the lower envelopes, the boundaries between
+    # them, and the index of the rightmost parabola of every line
+    v    = np.zeros((lines, n), dtype = int)
+    z    = np.full((lines, n + 1), np.inf)
+    k    = np.zeros(lines, dtype = int)
+    z[:, 0] = -np.inf
+
+    s = np.empty(lines)
+
+    for q in range(1, n):
+        # remove the parabolas that are hidden by the one rooted at q
+        todo = rows
+
+        while len(todo) > 0:
+            vk = v[todo, k[todo]]
+            st = ((f[todo, q] + q * q) - (f[todo, vk] + vk * vk)) / (2 * q - 2 * vk)
+
+            hidden           = st <= z[todo, k[todo]]
+            s[todo[~hidden]] = st[~hidden]
+            todo             = todo[hidden]
+            k[todo]         -= 1
+
+        k             += 1
+        v[rows, k]     = q
+        z[rows, k]     = s
+        z[rows, k + 1] = np.inf
+
+    d = np.empty_like(f)
+    k = np.zeros(lines, dtype = int)
+
+    for q in range(n):
+        # move on to the parabola that is lowest at q
+        while True:
+            behind = z[rows, k + 1] < q
+
+            if not behind.any():
+                break
+
+            k[behind] += 1
+
+        vk      = v[rows, k]
+        d[:, q] = (q - vk) ** 2 + f[rows, vk]
+
+    return d
+
+
+# The squared euclidean distance (in grid cells) from every cell of a 3D array
+# to the nearest cell that is True. Since the distance transform is separable,
+# it is enough to transform along each axis after another. Cells without any
+# True cell in the array get an infinite distance.
+#
+# The distances are integers, so they are stored exactly as float32. The lines
+# are transformed in chunks of about chunkSize cells to bound the memory for
+# the intermediate float64 arrays.
+def squaredDistanceTransform(occupied, chunkSize = 2 ** 20, deadline = inf):
+    # a large, but finite value, so that the arithmetic above keeps working
+    far = 3.0 * sum(n * n for n in occupied.shape) + 1.0
+    d   = np.where(occupied, np.float32(0), np.float32(far))
+
+    for axis in range(d.ndim):
+        moved = np.moveaxis(d, axis, -1)
+        slab  = int(np.prod(moved.shape[1:]))
+        step  = max(1, chunkSize // max(1, slab))
+
+        for i in range(0, moved.shape[0], step):
+            chunk = moved[i : i + step]
+            lines = chunk.reshape(-1, chunk.shape[-1]).astype(float)
+
+            chunk[...] = squaredDistanceTransform1D(lines).reshape(chunk.shape)
+
+            # the transform of a large grid takes long enough to count
+            # towards the time that planning may take
+            if perf_counter() > deadline:
+                raise PlanningTimeout("Planning took longer than allowed!")
+
+    d[d >= far] = np.inf
+
+    return d
+
+
+# The grid cells that the given obstacle may occupy in a grid of the given shape
+# and resolution, as a pair (ranges, exact) where ranges is a tuple of slices.
+# If exact is True, exactly the cells in the ranges are occupied, otherwise
+# their centres have to be sampled. Returns None if no cell can be occupied.
+def obstacleCells(obstacle, shape, resolution):
+    box = obstacle.boundingBox()
+
+    # nothing is known about the shape, so we have to sample the whole grid
+    if box is None:
+        return (tuple(slice(0, n) for n in shape), False)
+
+    # A box is the product of its extents along the axes, so it is enough to
+    # sample one line of cell centres through the box per axis. This gives
+    # exactly the same cells as sampling the whole grid.
+    if obstacle.isBox():
+        centre = (box[0] + box[1]) / 2
+        ranges = []
+
+        for axis, n in enumerate(shape):
+            line          = np.tile(centre, (n, 1))
+            line[:, axis] = (np.arange(n) + 0.5) * resolution
+            inside        = np.flatnonzero(obstacle.containsPoints(line))
+
+            if len(inside) == 0:
+                return None
+
+            ranges.append(slice(int(inside[0]), int(inside[-1]) + 1))
+
+        return (tuple(ranges), True)
+
+    # otherwise, only the cells within the bounding box (with a margin of one
+    # cell to be safe from rounding) have to be sampled
+    lower  = np.floor(box[0] / resolution).astype(int) - 1
+    upper  = np.floor(box[1] / resolution).astype(int) + 2
+    ranges = tuple(slice(max(0, int(l)), min(n, int(u))) for l, u, n in zip(lower, upper, shape))
+
+    if any(r.stop <= r.start for r in ranges):
+        return None
+
+    return (ranges, False)
+
+
+# Raised when planning a path takes longer than the given timeout.
+class PlanningTimeout(Exception):
+    pass
+
+
+# Raised when there is no path, e.g. because the start or the target was
+# blocked by an obstacle that was added.
+class PathUnreachable(Exception):
+    pass
+
 
 # A scene is represented as a cuboid and contains a set of obstacles that should
 # be avoided in path planning. When constructed, the scene is represented as a
-# regular cartesian grid according to the given resolution. The space is sampled
-# and occupied grid cells are marked.
+# regular cartesian grid according to the given resolution. Axis-aligned boxes
+# are filled in directly, the space is sampled for all other obstacles and
+# occupied grid cells are marked.
+#
+# If a cacheDir is given, the rasterized scene is stored there and reused when a
+# scene with the same dimensions, resolution and obstacles is built again. If
+# space is given, it is used as the occupancy instead of rasterizing obstacles.
 class Scene():
-    def __init__(self, dimX, dimY, dimZ, resolution, obstacles):
+    debug = True
+
+    # to be increased whenever the cached arrays change their meaning
+    cacheVersion = 3
+
+    # how many search grids for different clearances are kept at most
+    gridCapacity = 8
+
+    def __init__(self, dimX, dimY, dimZ, resolution, obstacles, cacheDir = None, space = None):
       self.resolution = resolution
       self.bounds     = Scale(Cube(), dimX, dimY, dimZ)
 
@@ -117,17 +797,223 @@ class Scene():
       y = int(dimY / resolution)
       z = int(dimZ / resolution)
 
-      # to store which cells are occupied
-      self.space = np.zeros((x, y, z))
+      # the obstacles in the scene, which may change at runtime
+      self.obstacles = list(obstacles)
+
+      self.cacheFile = None
+      key            = self.cacheKey(dimX, dimY, dimZ, resolution, obstacles)
+
+      if cacheDir is not None and key is not None:
+          self.cacheFile = os.path.join(cacheDir, "scene-{}.npz".format(key))
+
+      # The squared distances (in grid cells) from the middles of the grid
+      # cells to the middles of the nearest occupied cells. With that, minimum
+      # clearances to the obstacles are just thresholds. They take 32 times
+      # the memory of the occupancy, so they are only computed when a clearance
+      # is asked for, see distances.
+      self.squaredDistances  = None
+      self.distancesOutdated = True
+
+      # the occupancy was rasterized before, e.g. by another process
+      if space is not None:
+          self.space = space
+
+      elif not self.load((x, y, z)):
+          # to store which cells are occupied, with one bit per cell
+          self.space = OccupancyGrid((x, y, z))
+
+          # Build the scene according to the given resolution and represent it
+          # as a 3D grid with boolean values where True means that the
+          # respective spot is occupied by an obstacle.
+          for obstacle in obstacles:
+              self.rasterize(obstacle)
+
+          self.save()
+
+      # the grids for searches, for the gridCapacity minimum clearances that
+      # were asked for most recently, built when they are needed for the first
+      # time, see grid
+      self.flatGrids = OrderedDict()
+
+      # Paths can be planned by several threads at the same time, see
+      # server.py, so the distances and grids are built under this lock, and
+      # lastExpansions is kept for every thread separately. Changing obstacles
+      # must not overlap with planning.
+      self.lock    = RLock()
+      self.threads = local()
+
+      # to be increased whenever the obstacles in the scene change, so that
+      # paths planned in the scene can be recognised as outdated
+      self.version = 0
+
+    # A hash of everything the rasterized scene depends on, or None if some
+    # obstacle cannot describe itself.
+    def cacheKey(self, dimX, dimY, dimZ, resolution, obstacles):
+        descriptions = [obstacle.describe() for obstacle in obstacles]
+
+        if None in descriptions:
+            return None
+
+        scene = "{}|{!r}|{!r}|{!r}|{!r}|{}".format( self.cacheVersion
+                                                  , dimX, dimY, dimZ
+                                                  , resolution
+                                                  , ";".join(descriptions)
+                                                  )
+
+        return sha256(scene.encode()).hexdigest()
+
+    # Loads the rasterized scene from the cache file. Returns whether that
+    # worked, a missing or broken cache file just means that the scene has to
+    # be built.
+    def load(self, shape):
+        if self.cacheFile is None or not os.path.exists(self.cacheFile):
+            return False
+
+        try:
+            with np.load(self.cacheFile) as cached:
+                space = OccupancyGrid(shape, cached["space"])
+        except Exception:
+            return False
+
+        if space.bits.shape != shape[:2] + ((shape[2] + 7) // 8,):
+            return False
+
+        self.space = space
+
+        return True
+
+    # Stores the rasterized scene in the cache file. The file is written under
+    # a temporary name first and then renamed, so that processes that start at
+    # the same time never see half a file.
+    def save(self):
+        if self.cacheFile is None:
+            return
+
+        directory = os.path.dirname(self.cacheFile)
+        temporary = "{}.{}.tmp".format(self.cacheFile, os.getpid())
+
+        try:
+            if directory:
+                os.makedirs(directory, exist_ok = True)
+
+            with open(temporary, "wb") as f:
+                np.savez_compressed(f, space = self.space.bits)
+
+            os.replace(temporary, self.cacheFile)
+        except OSError:
+            # the cache is only an optimisation
+            if os.path.exists(temporary):
+                os.remove(temporary)
+
+    # Marks the grid cells whose centres lie within the given obstacle.
+    def rasterize(self, obstacle):
+        cells = obstacleCells(obstacle, self.space.shape, self.resolution)
+
+        if cells is None:
+            return
+
+        ranges, exact = cells
 
-      # Build the scene according to the given resolution and sample the space to
-      # represent it as a 3D array with boolean values where True means that the
-      # respective spot is occupied by an obstacle
-      for i in range(x):
-          for j in range(y):
-              for k in range(z):
-                  p = Point((i + 0.5) * resolution, (j + 0.5) * resolution, (k + 0.5) * resolution)
-                  self.space[i, j, k] = any([obstacle.contains(p) for obstacle in obstacles])
+        if exact:
+            self.space[ranges] = True
+        else:
+            self.sample(obstacle, ranges)
+
+    # Adds an obstacle to the scene at runtime. Only the cells of the obstacle
+    # and the cells of the search grids around it are updated. Paths must not
+    # be planned in the meantime.
+    def addObstacle(self, obstacle):
+        with self.lock:
+            self.obstacles.append(obstacle)
+
+            cells = obstacleCells(obstacle, self.space.shape, self.resolution)
+
+            if cells is not None:
+                self.rasterize(obstacle)
+                self.changed(cells[0])
+
+            self.version += 1
+
+    # Removes an obstacle from the scene at runtime. The cells of the obstacle
+    # are freed and the other obstacles are filled in again where they overlap.
+    def removeObstacle(self, obstacle):
+        with self.lock:
+            if not any(o is obstacle for o in self.obstacles):
+                raise Exception("Obstacle {} is not in the scene!".format(obstacle))
+
+            self.obstacles = [o for o in self.obstacles if o is not obstacle]
+
+            cells = obstacleCells(obstacle, self.space.shape, self.resolution)
+
+            if cells is not None:
+                ranges = cells[0]
+
+                self.space.clear(ranges)
+
+                for other in self.obstacles:
+                    otherCells = obstacleCells(other, self.space.shape, self.resolution)
+
+                    if otherCells is None:
+                        continue
+
+                    overlap = tuple( slice(max(r.start, o.start), min(r.stop, o.stop))
+                                     for r, o in zip(ranges, otherCells[0])
+                                   )
+
+                    if any(r.stop <= r.start for r in overlap):
+                        continue
+
+                    if otherCells[1]:
+                        self.space.fill(overlap)
+                    else:
+                        self.sample(other, overlap)
+
+                self.changed(ranges)
+
+            self.version += 1
+
+    # Updates the search grids after the cells in the given ranges changed.
+    # For a minimum clearance of r cells, the cells up to r cells around the
+    # ranges may change, and only the obstacles up to 2r cells around the
+    # ranges can be close enough to them.
+    def changed(self, ranges):
+        self.squaredDistances  = None
+        self.distancesOutdated = True
+
+        for minClearance, grid in self.flatGrids.items():
+            r     = self.clearanceCells(minClearance)
+            inner = tuple(slice(max(0, s.start - r),     min(n, s.stop + r))     for s, n in zip(ranges, self.space.shape))
+            outer = tuple(slice(max(0, s.start - 2 * r), min(n, s.stop + 2 * r)) for s, n in zip(ranges, self.space.shape))
+
+            if r == 0:
+                grid.occupied[inner] = self.space.region(inner)
+            else:
+                local     = tuple(slice(i.start - o.start, i.stop - o.start) for i, o in zip(inner, outer))
+                distances = squaredDistanceTransform(self.space.region(outer))
+
+                grid.occupied[inner] = distances[local] < r * r
+
+            grid.changed(inner)
+
+    # Samples the centres of the grid cells in the given index ranges and marks
+    # those that lie within the obstacle.
+    # The region is sampled in slabs along the x-axis of about chunkSize cells,
+    # so that the coordinates of all the centres never have to be in memory.
+    def sample(self, obstacle, ranges, chunkSize = 2 ** 18):
+        shape = tuple(max(0, r.stop - r.start) for r in ranges)
+
+        if 0 in shape:
+            return
+
+        step = max(1, chunkSize // (shape[1] * shape[2]))
+
+        for x in range(ranges[0].start, ranges[0].stop, step):
+            slab    = (slice(x, min(x + step, ranges[0].stop)),) + tuple(ranges[1:])
+            shape   = (slab[0].stop - x,) + shape[1:]
+            cells   = np.indices(shape).reshape(3, -1).T + [r.start for r in slab]
+            centres = (cells + 0.5) * self.resolution
+
+            self.space.fill(slab, obstacle.containsPoints(centres).reshape(shape))
 
     # Get the middle of a given grid cell (gx, gy, gz).
     def getPoint(self, xyz):
@@ -143,34 +1029,279 @@ class Scene():
                , int(point.z  / self.resolution)
                )
 
+    # The distance from the given point to the nearest obstacle, measured
+    # between the middles of the grid cells. It is 0 within obstacles and
+    # infinite if there are no obstacles in the scene.
+    def clearance(self, point):
+        x, y, z = self.getCoordinate(point)
+        return float(np.sqrt(self.distances()[x, y, z])) * self.resolution
+
+    # The squared distances from the cells to the nearest occupied cells, see
+    # squaredDistances. They are computed when they are needed for the first
+    # time, and again after the obstacles changed.
+    def distances(self, deadline = inf):
+        with self.lock:
+            if self.distancesOutdated:
+                self.squaredDistances  = squaredDistanceTransform(self.space.toArray(), deadline = deadline)
+                self.distancesOutdated = False
+
+            return self.squaredDistances
+
+    # The cells that must be avoided to keep the given clearance from obstacles.
+    def occupancy(self, minClearance = 0.0, deadline = inf):
+        r = self.clearanceCells(minClearance)
+
+        if r == 0:
+            return self.space.toArray()
+
+        return self.distances(deadline) < r * r
+
+    # The clearance that is kept for minClearance, in grid cells: rounded up,
+    # so that close clearances share their grids. The small tolerance keeps
+    # multiples of the resolution, e.g. 0.3 / 0.1, from being rounded up.
+    def clearanceCells(self, minClearance):
+        return max(0, ceil(minClearance / self.resolution - 1e-9))
+
+    # the clearance that is kept for minClearance, in meters
+    def roundClearance(self, minClearance):
+        return self.clearanceCells(minClearance) * self.resolution
+
+    # The grid in the form that is used for searches, with the cells blocked
+    # that are closer than minClearance (rounded, see roundClearance) to an
+    # obstacle. Only the grids of the gridCapacity most recently used
+    # clearances are kept, the others are dropped and no longer updated when
+    # obstacles change. Building a grid may raise a PlanningTimeout after the
+    # deadline.
+    def grid(self, minClearance = 0.0, deadline = inf):
+        minClearance = self.roundClearance(minClearance)
+
+        with self.lock:
+            grid = self.flatGrids.get(minClearance)
+
+            if grid is None:
+                grid = Grid(self.occupancy(minClearance, deadline), self.resolution)
+
+                self.flatGrids[minClearance] = grid
+
+                if len(self.flatGrids) > self.gridCapacity:
+                    self.flatGrids.popitem(last = False)
+            else:
+                self.flatGrids.move_to_end(minClearance)
+
+            return grid
+
+    # the number of cells that the last search of the current thread expanded
+    @property
+    def lastExpansions(self):
+        return getattr(self.threads, "lastExpansions", 0)
+
+    @lastExpansions.setter
+    def lastExpansions(self, expansions):
+        self.threads.lastExpansions = expansions
+
+    # The heuristic for searches: the distance from the middle of a grid cell to
+    # the target point. Calculated in the same way as by Grid.distanceTables.
+    def heuristic(self, cell, target):
+        dx = (cell[0] + 0.5) * self.resolution - target.x
+        dy = (cell[1] + 0.5) * self.resolution - target.y
+        dz = (cell[2] + 0.5) * self.resolution - target.z
+
+        return np.sqrt(dx * dx + dy * dy + dz * dz)
+
+    # The available planning algorithms.
+    def planners(self):
+        return { "astar"       : self.astar
+               , "astar-tuple" : self.astarTuple
+               , "jps"         : self.jumpPointSearch
+               , "hierarchical": self.hierarchicalSearch
+               , "lazytheta"   : self.lazyThetaStar
+               , "bidirectional": self.bidirectionalAstar
+               }
+
     # Use A* to plan a path from start to target and avoids the obstacles in the scene.
-    def planPath(self, start, target):
-        # the start point must be within the scene
-        if not self.bounds.contains(start):
-            raise Exception("Start ({:.2f}, {:.2f}, {:.2f}) is out of bounds!".format(start.x, start.y, start.z))
+    # The algorithm selects how the search is done:
+    #   "astar"       A* on linear cell indices into flat arrays (default)
+    #   "astar-tuple" A* on (x, y, z) tuples, which is slower but easier to follow
+    #   "jps"         jump point search, which expands far fewer cells in open space
+    #   "hierarchical" A* at coarser resolutions first, then only within a
+    #                 corridor around the coarse path, see hierarchicalSearch
+    #   "lazytheta"   any-angle paths with Lazy Theta*, see lazyThetaStar
+    #   "bidirectional" A* from start and from target at the same time, see
+    #                 bidirectionalAstar
+    # All but "hierarchical" and "lazytheta" find shortest paths on the grid,
+    # the first two even the same path.
+    # If minClearance is given, the path keeps at least that distance (in
+    # meters) from the obstacles, see clearance. If smooth is True, waypoints
+    # that can be skipped are dropped from the path, see smoothPath. If a
+    # timeout (in seconds) is given, planning raises a PlanningTimeout when it
+    # takes longer.
+    def planPath(self, start, target, algorithm = "astar", minClearance = 0.0, smooth = False, timeout = None):
+        cells = self.planCells(start, target, algorithm, minClearance, timeout)
+        path  = self.pathFromCells(cells, target)
+
+        if smooth:
+            path = self.smoothPath(path, minClearance)
+
+        return self.postprocessPath(path)
+
+    # The grid cell of a point where a path starts or ends. The point must be
+    # within the scene, outside of obstacles and far enough from them.
+    def freeCell(self, point, role, grid, minClearance):
+        if not self.bounds.contains(point):
+            raise Exception("{} ({:.2f}, {:.2f}, {:.2f}) is out of bounds!".format(role, point.x, point.y, point.z))
 
-        # the target point must be within the scene
-        if not self.bounds.contains(target):
-            raise Exception("Target ({:.2f}, {:.2f}, {:.2f}) is out of bounds!".format(target.x, target.y, target.z))
+        cell = self.getCoordinate(point)
+
+        if self.space[cell[0], cell[1], cell[2]]:
+            raise PathUnreachable("{} {} point lies within an obstacle!".format(role, self.getPoint(cell)))
+
+        if grid.occupied[cell]:
+            raise PathUnreachable("{} {} point is closer than {:.2f}m to an obstacle!".format(role, self.getPoint(cell), minClearance))
+
+        return cell
+
+    # Same as planPath, but returns the grid cells along the path from the cell
+    # of start to the cell of target.
+    def planCells(self, start, target, algorithm = "astar", minClearance = 0.0, timeout = None):
+        planners = self.planners()
+
+        if algorithm not in planners:
+            raise Exception("Unknown planning algorithm: {}".format(algorithm))
+
+        deadline = inf if timeout is None else perf_counter() + timeout
+        grid     = self.grid(minClearance, deadline)
 
         # the grid cells corresponding to start and target
-        startCell  = self.getCoordinate(start)
-        targetCell = self.getCoordinate(target)
+        startCell  = self.freeCell(start,  "Start",  grid, minClearance)
+        targetCell = self.freeCell(target, "Target", grid, minClearance)
+
+        cells, self.lastExpansions = planners[algorithm](grid, startCell, targetCell, target, deadline)
 
-        # the start point must not lie within an obstacle
-        if self.space[startCell[0], startCell[1], startCell[2]]:
-            raise Exception("Start {} point lies within an obstacle!".format(self.getPoint(startCell)))
+        return cells
 
-        # the target point must not lie within an obstacle
-        if self.space[targetCell[0], targetCell[1], targetCell[2]]:
-            raise Exception("Target {} point lies within an obstacle!".format(self.getPoint(startCell)))
+    # Plans many paths at once, spread over a pool of worker processes. The
+    # requests are (start, target) pairs, the other arguments are the same as
+    # for planPath. The occupancy and the search grid are put into shared
+    # memory once, so that the workers do not need their own copies. Returns,
+    # in the order of the requests, the path or the exception that planning
+    # the path raised.
+    def planPaths(self, requests, algorithm = "astar", minClearance = 0.0, smooth = False, workers = None):
+        workers = workers or os.cpu_count() or 1
+        grid    = self.grid(minClearance)
+        bits    = self.space.bits
+        memory  = shared_memory.SharedMemory(create = True, size = grid.blocked.nbytes + bits.nbytes)
+        layout  = ( memory.name
+                  , grid.paddedShape
+                  , bits.shape
+                  , self.space.shape
+                  , (self.bounds.scaleX, self.bounds.scaleY, self.bounds.scaleZ)
+                  , self.resolution
+                  , minClearance
+                  )
 
-        # explored and unexplored cells
+        try:
+            np.ndarray(grid.blocked.shape, dtype = bool, buffer = memory.buf)[:] = grid.blocked
+            np.ndarray(bits.shape, dtype = np.uint8, buffer = memory.buf, offset = grid.blocked.nbytes)[:] = bits
+
+            queries = [ ((start.x, start.y, start.z), (target.x, target.y, target.z), algorithm, minClearance, smooth)
+                        for start, target in requests
+                      ]
+
+            with ProcessPoolExecutor(max_workers = workers, initializer = attachWorkerScene, initargs = layout) as pool:
+                return list(pool.map(planInWorker, queries, chunksize = max(1, len(queries) // (4 * workers))))
+        finally:
+            memory.close()
+            memory.unlink()
+
+    # Dijkstra's algorithm from start over the flat grid. Instead of a single
+    # path, this finds the cheapest paths from start to all cells, so that many
+    # targets can be served with a single search. If targets are given, the
+    # search stops as soon as all of them are settled. Returns a
+    # ShortestPathTree. Like planPath, the search may be limited by a timeout.
+    def planFrom(self, start, targets = None, minClearance = 0.0, timeout = None):
+        deadline  = inf if timeout is None else perf_counter() + timeout
+        grid      = self.grid(minClearance, deadline)
+        startCell = self.freeCell(start, "Start", grid, minClearance)
+        start     = grid.index(startCell)
+
+        # the targets that have not been settled yet
+        remaining = None
+
+        if targets is not None:
+            remaining = set( grid.index(self.getCoordinate(target))
+                             for target in targets
+                             if self.bounds.contains(target)
+                           )
+            remaining = set(i for i in remaining if not grid.blocked[i])
+
+        costs    = np.full(len(grid.blocked), np.inf)
+        cameFrom = np.full(len(grid.blocked), -1, dtype = np.int32)
+        closed   = grid.blocked.copy()
+
+        g, parent, explored = [memoryview(a) for a in [costs, cameFrom, closed]]
+
+        steps = list(zip(grid.offsets.tolist(), grid.stepCosts.tolist()))
+
+        g[start]      = 0.0
+        parent[start] = start
+        unexplored    = [(0.0, start)]
+        expansions    = 0
+
+        # whether all cells that can be reached get settled, which is not the
+        # case when the search stops early
+        complete = remaining is None or len(remaining) > 0
+
+        # none of the targets can be settled, so only the start is
+        if not complete:
+            explored[start] = True
+            unexplored      = []
+
+        while unexplored:
+            currentCost, current = heappop(unexplored)
+
+            # an outdated entry for a cell that has been queued again
+            if explored[current]:
+                continue
+
+            explored[current] = True
+            expansions       += 1
+
+            # give up if planning takes too long
+            if expansions & 1023 == 0 and perf_counter() > deadline:
+                raise PlanningTimeout("Planning took longer than allowed!")
+
+            if remaining is not None:
+                remaining.discard(current)
+
+                # all targets are settled
+                if not remaining:
+                    complete = False
+                    break
+
+            for offset, stepCost in steps:
+                neighbour = current + offset
+                cost      = currentCost + stepCost
+
+                if cost < g[neighbour] and not explored[neighbour]:
+                    g[neighbour]      = cost
+                    parent[neighbour] = current
+
+                    heappush(unexplored, (cost, neighbour))
+
+        self.lastExpansions = expansions
+
+        return ShortestPathTree(self, grid, minClearance, start, costs, cameFrom, closed & ~grid.blocked, complete)
+
+    # A* on (x, y, z) tuples. Returns the grid cells from startCell to targetCell
+    # and the number of expanded cells.
+    def astarTuple(self, grid, startCell, targetCell, target, deadline = inf):
+        # explored cells
         explored   = set()
-        unexplored = { startCell : start.distanceTo(target) }
 
-        # a queue of cells to retrieve that cell with expected lowest cost
-        queue      = Empty(key = snd).insert(((startCell), start.distanceTo(target)))
+        # unexplored cells, queued by their expected cost to get to the target
+        # through them
+        unexplored = IndexedHeap()
+        unexplored.push(startCell, self.heuristic(startCell, target))
 
         # for reconstructing the path, stores the predecessor of cells along the cheapest path
         cameFrom   = { startCell : startCell }
@@ -179,49 +1310,595 @@ class Scene():
         costs      = { startCell : 0 }
 
         # continue planning as long as we have unexplored grid cells left
-        while len(unexplored) > 0:
-            (current, currentCost), queue = queue.popMin()
-            while current not in unexplored:
-                (current, currentCost), queue = queue.popMin()
-            unexplored.pop(current)
+        while not unexplored.isEmpty():
+            current, _ = unexplored.popMin()
             explored.add(current)
 
+            # give up if planning takes too long
+            if len(explored) & 1023 == 0 and perf_counter() > deadline:
+                raise PlanningTimeout("Planning took longer than allowed!")
+
             # we found a path!
             if current == targetCell:
-                return self.postprocessPath(self.reconstructPath(cameFrom, current, target))
+                return (self.reconstructPath(cameFrom, current), len(explored))
 
-            p = self.getPoint(current)
+            currentCost = costs[current]
 
-            for dx in [-1, 0, 1]:
-                for dy in [-1, 0, 1]:
-                    for dz in [-1, 0, 1]:
-                        x = current[0] + dx
-                        y = current[1] + dy
-                        z = current[2] + dz
+            for (dx, dy, dz), stepCost in zip(grid.directions.tolist(), grid.stepCosts.tolist()):
+                x = current[0] + dx
+                y = current[1] + dy
+                z = current[2] + dz
 
-                        q = self.getPoint((x, y, z))
+                q = self.getPoint((x, y, z))
 
-                        if (x, y, z) not in explored and self.bounds.contains(q) and not self.space[x, y, z]:
-                            cost = currentCost + p.distanceTo(q)
+                if (x, y, z) not in explored and self.bounds.contains(q) and not grid.occupied[x, y, z]:
+                    cost = currentCost + stepCost
 
-                            if (x, y, z) not in unexplored or cost < unexplored[(x, y, z)]:
-                                queue = queue.insert(((x, y, z), cost + q.distanceTo(target)))
-                                unexplored[(x, y, z)] = cost
-                                cameFrom[(x, y, z)]   = current
-                                costs[(x, y, z)]      = cost
+                    if (x, y, z) not in costs or cost < costs[(x, y, z)]:
+                        unexplored.pushOrDecrease((x, y, z), cost + self.heuristic((x, y, z), target))
+                        cameFrom[(x, y, z)] = current
+                        costs[(x, y, z)]    = cost
 
-        raise Exception("Cannot find a path to target!")
+        raise PathUnreachable("Cannot find a path to target!")
 
-    def reconstructPath(self, cameFrom, endpoint, target):
-        path = [ target
-               , self.getPoint(endpoint)
-               ]
+    def reconstructPath(self, cameFrom, endpoint):
+        path = [endpoint]
 
         while endpoint != cameFrom[endpoint]:
             endpoint = cameFrom[endpoint]
-            path.append(self.getPoint(endpoint))
+            path.append(endpoint)
         return path[::-1]
 
+    # A* on linear cell indices. The costs, predecessors and explored cells are
+    # kept in preallocated flat arrays, and the offsets, directions and costs
+    # of the steps to the neighbours come from the tables of the grid. The
+    # arrays are accessed through memoryviews, which is much faster than
+    # indexing NumPy arrays element by element.
+    #
+    # The queue is a heapq with entries (priority, order, cell), where order is
+    # the number of cells that were queued before the cell was queued for the
+    # first time. Instead of decreasing the priority of a queued cell, we queue
+    # it again and skip the outdated entry once the cell is explored. This
+    # retrieves cells in exactly the same order as an IndexedHeap, but heapq is
+    # implemented in C.
+    #
+    # Returns the grid cells from startCell to targetCell and the number of
+    # expanded cells.
+    def astar(self, grid, startCell, targetCell, target, deadline = inf):
+        sx, sy     = grid.strides
+        start      = grid.index(startCell)
+        goal       = grid.index(targetCell)
+
+        # costs to get to the cells, predecessors along the cheapest paths, and
+        # cells that we must not expand (anymore), i.e. obstacles, the padding
+        # and already explored cells
+        costs      = np.full(len(grid.blocked), np.inf)
+        cameFrom   = np.full(len(grid.blocked), -1, dtype = np.int32)
+        closed     = grid.blocked.copy()
+        order      = np.zeros(len(grid.blocked), dtype = np.int32)
+
+        g, parent, explored, queued = [memoryview(a) for a in [costs, cameFrom, closed, order]]
+
+        tx, ty, tz = [t.tolist() for t in grid.distanceTables(target)]
+        steps      = list(zip(grid.offsets.tolist(), grid.stepCosts.tolist(), *grid.directions.T.tolist()))
+
+        g[start]      = 0.0
+        parent[start] = start
+        unexplored    = [(self.heuristic(startCell, target), 0, start)]
+        pushed        = 1
+        expansions    = 0
+
+        while unexplored:
+            _, _, current = heappop(unexplored)
+
+            # an outdated entry for a cell that has been queued again
+            if explored[current]:
+                continue
+
+            explored[current] = True
+            expansions       += 1
+
+            # give up if planning takes too long
+            if expansions & 1023 == 0 and perf_counter() > deadline:
+                raise PlanningTimeout("Planning took longer than allowed!")
+
+            # we found a path!
+            if current == goal:
+                path = [current]
+
+                while current != start:
+                    current = parent[current]
+                    path.append(current)
+
+                return ([grid.cell(i) for i in reversed(path)], expansions)
+
+            currentCost = g[current]
+
+            # the padded coordinates of the current cell, for the heuristic
+            x, rest = divmod(current, sx)
+            y, z    = divmod(rest,    sy)
+
+            for offset, stepCost, dx, dy, dz in steps:
+                neighbour = current + offset
+                cost      = currentCost + stepCost
+
+                if cost < g[neighbour] and not explored[neighbour]:
+                    if g[neighbour] == inf:
+                        queued[neighbour] = pushed
+                        pushed           += 1
+
+                    g[neighbour]      = cost
+                    parent[neighbour] = current
+
+                    heappush(unexplored, ( cost + sqrt(tx[x + dx] + ty[y + dy] + tz[z + dz])
+                                         , queued[neighbour]
+                                         , neighbour
+                                         ))
+
+        raise PathUnreachable("Cannot find a path to target!")
+
+    # Hierarchical A*. The path is planned at the coarsest resolution first,
+    # then at finer and finer resolutions within a corridor of corridorWidth
+    # coarse cells around the previous path, and finally with grid cells. Only
+    # the cells within the corridors have to be explored. The coarse levels are
+    # the factors by which the resolution is coarser, e.g. 0.8m and 0.4m for a
+    # resolution of 0.1m.
+    #
+    # Coarse cells are occupied as soon as any of their cells is occupied, so
+    # the coarse levels may miss narrow passages. If a level does not find a
+    # path, it is skipped, and if the corridor does not contain a path, the
+    # whole grid is searched. The path avoids the obstacles, but it may be a
+    # bit longer than the shortest one.
+    #
+    # Returns the grid cells from startCell to targetCell and the number of
+    # expanded cells at all levels.
+    def hierarchicalSearch(self, grid, startCell, targetCell, target, deadline = inf, levels = (8, 4), corridorWidth = 1):
+        corridor   = None
+        expansions = 0
+
+        # the factor of the level that the corridor belongs to
+        corridorFactor = None
+
+        for factor in sorted(levels, reverse = True):
+            occupied = grid.coarse(factor).copy()
+
+            # only search within the corridor of the previous level
+            if corridor is not None:
+                occupied |= ~upsample(corridor, corridorFactor // factor, occupied.shape)
+
+            # the cells of start and target contain at least these free cells
+            coarseStart  = tuple(c // factor for c in startCell)
+            coarseTarget = tuple(c // factor for c in targetCell)
+
+            occupied[coarseStart]  = False
+            occupied[coarseTarget] = False
+
+            try:
+                cells, expanded = self.astar(Grid(occupied, grid.resolution * factor), coarseStart, coarseTarget, target, deadline)
+            except PlanningTimeout:
+                raise
+            except Exception:
+                continue
+
+            expansions += expanded
+            onPath      = np.zeros(occupied.shape, dtype = bool)
+
+            onPath[tuple(np.array(cells).T)] = True
+
+            corridor       = dilate(onPath, corridorWidth)
+            corridorFactor = factor
+
+        if corridor is not None:
+            try:
+                occupied = grid.occupied | ~upsample(corridor, corridorFactor, grid.shape)
+                cells, expanded = self.astar(Grid(occupied, grid.resolution), startCell, targetCell, target, deadline)
+
+                return (cells, expansions + expanded)
+            except PlanningTimeout:
+                raise
+            except Exception:
+                pass
+
+        cells, expanded = self.astar(grid, startCell, targetCell, target, deadline)
+
+        return (cells, expansions + expanded)
+
+    # Bidirectional A* on the flat grid. One search runs from start towards
+    # target and one from target towards start, always continuing the one with
+    # fewer queued cells. Whenever one search reaches a cell that the other one
+    # has already reached, the two halves form a path from start to target, and
+    # the cheapest of these is kept.
+    #
+    # Both searches use the average of the distances to the cell they search
+    # towards and from the cell they started at, (d(v, to) - d(v, from)) / 2,
+    # as heuristic. These are consistent and sum up to 0 for every cell, so the
+    # search can stop as soon as the lowest keys of both queues add up to the
+    # cost of the cheapest path found so far (Goldberg and Harrelson, "Computing
+    # the Shortest Path: A* Search Meets Graph Theory").
+    #
+    # Returns the grid cells from startCell to targetCell and the number of
+    # expanded cells in both directions.
+    def bidirectionalAstar(self, grid, startCell, targetCell, target, deadline = inf):
+        sx, sy = grid.strides
+        start  = grid.index(startCell)
+        goal   = grid.index(targetCell)
+        steps  = list(zip(grid.offsets.tolist(), grid.stepCosts.tolist(), *grid.directions.T.tolist()))
+
+        if start == goal:
+            return ([startCell], 0)
+
+        # for both directions: the costs to get to the cells from where the
+        # search started, the predecessors, the closed cells, the distance
+        # tables to the cells searched towards and from, and the queue
+        searches = []
+
+        for origin, towards in [(startCell, targetCell), (targetCell, startCell)]:
+            costs    = np.full(len(grid.blocked), np.inf)
+            cameFrom = np.full(len(grid.blocked), -1, dtype = np.int32)
+            closed   = grid.blocked.copy()
+
+            g, parent, explored = [memoryview(a) for a in [costs, cameFrom, closed]]
+
+            to   = [t.tolist() for t in grid.distanceTables(self.getPoint(towards))]
+            back = [t.tolist() for t in grid.distanceTables(self.getPoint(origin))]
+            x, y, z = [c + 1 for c in origin]
+            i       = grid.index(origin)
+
+            g[i]      = 0.0
+            parent[i] = i
+
+            key = 0.5 * (sqrt(to[0][x] + to[1][y] + to[2][z]) - sqrt(back[0][x] + back[1][y] + back[2][z]))
+
+            searches.append((g, parent, explored, (to, back), [(key, 0, i)]))
+
+        # the cost of the cheapest path found so far and the cell where its two
+        # halves meet
+        best, meeting = inf, -1
+        pushed        = 1
+        expansions    = 0
+
+        while True:
+            # drop the outdated entries for cells that have been queued again
+            for g, parent, explored, tables, unexplored in searches:
+                while unexplored and explored[unexplored[0][2]]:
+                    heappop(unexplored)
+
+            forward, backward = searches
+
+            # no path can be cheaper than the best one anymore
+            if not forward[4] or not backward[4] or forward[4][0][0] + backward[4][0][0] >= best:
+                break
+
+            if len(forward[4]) <= len(backward[4]):
+                (g, parent, explored, ((tx, ty, tz), (bx, by, bz)), unexplored), other = forward, backward
+            else:
+                (g, parent, explored, ((tx, ty, tz), (bx, by, bz)), unexplored), other = backward, forward
+
+            otherCosts = other[0]
+
+            _, _, current = heappop(unexplored)
+
+            explored[current] = True
+            expansions       += 1
+
+            # give up if planning takes too long
+            if expansions & 1023 == 0 and perf_counter() > deadline:
+                raise PlanningTimeout("Planning took longer than allowed!")
+            currentCost       = g[current]
+
+            # the padded coordinates of the current cell, for the heuristic
+            x, rest = divmod(current, sx)
+            y, z    = divmod(rest,    sy)
+
+            for offset, stepCost, dx, dy, dz in steps:
+                neighbour = current + offset
+                cost      = currentCost + stepCost
+
+                if cost < g[neighbour] and not explored[neighbour]:
+                    g[neighbour]      = cost
+                    parent[neighbour] = current
+
+                    heappush(unexplored, ( cost + 0.5 * (sqrt(tx[x + dx] + ty[y + dy] + tz[z + dz]) - sqrt(bx[x + dx] + by[y + dy] + bz[z + dz]))
+                                         , pushed
+                                         , neighbour
+                                         ))
+                    pushed += 1
+
+                    # the two searches meet
+                    if cost + otherCosts[neighbour] < best:
+                        best, meeting = cost + otherCosts[neighbour], neighbour
+
+        if best == inf:
+            raise PathUnreachable("Cannot find a path to target!")
+
+        # the first half of the path backwards from the meeting cell to start,
+        # the second half from there to target
+        halves = []
+
+        for _, parent, _, _, _ in searches:
+            half, current = [meeting], meeting
+
+            while parent[current] != current:
+                current = parent[current]
+                half.append(current)
+
+            halves.append(half)
+
+        path = list(reversed(halves[0])) + halves[1][1:]
+
+        return ([grid.cell(i) for i in path], expansions)
+
+    # Lazy Theta* (Nash, Koenig and Tovey, "Lazy Theta*: Any-Angle Path Planning
+    # and Path Length Analysis in 3D"). Like A* on the flat grid, but a cell
+    # may have any cell as its parent that it can see, not only its neighbours.
+    # When a neighbour is queued, it is assumed to be visible from the parent
+    # of the current cell, and only when it is expanded, the line of sight is
+    # checked. If there is none, the best explored neighbour becomes its parent
+    # instead. This finds paths with straight lines in any direction, which are
+    # shorter than paths with the 26 directions of the grid.
+    #
+    # Returns the cells at the corners of the path from startCell to targetCell
+    # and the number of expanded cells.
+    def lazyThetaStar(self, grid, startCell, targetCell, target, deadline = inf):
+        sx, sy     = grid.strides
+        start      = grid.index(startCell)
+        goal       = grid.index(targetCell)
+        resolution = grid.resolution
+
+        # costs to get to the cells, parents along the cheapest paths, cells
+        # that we must not expand (anymore), and the order in which cells were
+        # queued for the first time
+        costs      = np.full(len(grid.blocked), np.inf)
+        cameFrom   = np.full(len(grid.blocked), -1, dtype = np.int32)
+        closed     = grid.blocked.copy()
+        order      = np.zeros(len(grid.blocked), dtype = np.int32)
+
+        g, parent, explored, queued = [memoryview(a) for a in [costs, cameFrom, closed, order]]
+
+        tx, ty, tz = [t.tolist() for t in grid.distanceTables(target)]
+        steps      = list(zip(grid.offsets.tolist(), grid.stepCosts.tolist()))
+
+        # the distance between the middles of two cells
+        def distance(i, j):
+            xi, rest = divmod(i, sx)
+            yi, zi   = divmod(rest, sy)
+            xj, rest = divmod(j, sx)
+            yj, zj   = divmod(rest, sy)
+
+            return resolution * sqrt((xi - xj) ** 2 + (yi - yj) ** 2 + (zi - zj) ** 2)
+
+        g[start]      = 0.0
+        parent[start] = start
+        unexplored    = [(self.heuristic(startCell, target), 0, start)]
+        pushed        = 1
+        expansions    = 0
+
+        while unexplored:
+            _, _, current = heappop(unexplored)
+
+            # an outdated entry for a cell that has been queued again
+            if explored[current]:
+                continue
+
+            # the parent was assumed to be visible, if it is not, take the best
+            # explored neighbour instead
+            if parent[current] != current and not grid.visible(parent[current], current):
+                g[current] = inf
+
+                for offset, stepCost in steps:
+                    neighbour = current + offset
+
+                    if explored[neighbour] and g[neighbour] + stepCost < g[current]:
+                        g[current]      = g[neighbour] + stepCost
+                        parent[current] = neighbour
+
+            explored[current] = True
+            expansions       += 1
+
+            # give up if planning takes too long
+            if expansions & 1023 == 0 and perf_counter() > deadline:
+                raise PlanningTimeout("Planning took longer than allowed!")
+
+            # we found a path!
+            if current == goal:
+                path = [current]
+
+                while current != start:
+                    current = parent[current]
+                    path.append(current)
+
+                return ([grid.cell(i) for i in reversed(path)], expansions)
+
+            # the neighbours are assumed to be visible from the parent
+            ancestor     = parent[current]
+            ancestorCost = g[ancestor]
+
+            for offset, stepCost in steps:
+                neighbour = current + offset
+
+                if explored[neighbour]:
+                    continue
+
+                cost = ancestorCost + distance(neighbour, ancestor)
+
+                if cost < g[neighbour]:
+                    if g[neighbour] == inf:
+                        queued[neighbour] = pushed
+                        pushed           += 1
+
+                    g[neighbour]      = cost
+                    parent[neighbour] = ancestor
+
+                    # the padded coordinates of the neighbour, for the heuristic
+                    x, rest = divmod(neighbour, sx)
+                    y, z    = divmod(rest,      sy)
+
+                    heappush(unexplored, ( cost + sqrt(tx[x] + ty[y] + tz[z])
+                                         , queued[neighbour]
+                                         , neighbour
+                                         ))
+
+        raise PathUnreachable("Cannot find a path to target!")
+
+    # Jump point search (Harabor and Grastien) in 3D. Instead of queueing all
+    # neighbours of a cell, the search jumps along straight lines in the grid
+    # until it reaches a cell that needs to be looked at, because there are
+    # obstacles around it that force a detour (see jumpPointRules), because a
+    # jump into a direction made up of components of the current one does, or
+    # because it is the target. Only these jump points are expanded.
+    #
+    # Returns the grid cells from startCell to targetCell, including the cells
+    # between jump points, and the number of expanded cells.
+    def jumpPointSearch(self, grid, startCell, targetCell, target, deadline = inf):
+        sx, sy     = grid.strides
+        start      = grid.index(startCell)
+        goal       = grid.index(targetCell)
+        offsets    = grid.offsets.tolist()
+        stepCosts  = grid.stepCosts.tolist()
+
+        natural    = grid.naturalDirections()
+        forced     = grid.forcedDirections
+
+        blocked    = memoryview(grid.blocked)
+        masks      = memoryview(grid.neighbourhoods())
+
+        costs      = np.full(len(grid.blocked), np.inf)
+        cameFrom   = np.full(len(grid.blocked), -1, dtype = np.int32)
+        closed     = grid.blocked.copy()
+        order      = np.zeros(len(grid.blocked), dtype = np.int32)
+        arrival    = np.zeros(len(grid.blocked), dtype = np.int8)
+
+        g, parent, explored, queued, direction = [memoryview(a) for a in [costs, cameFrom, closed, order, arrival]]
+
+        tx, ty, tz = [t.tolist() for t in grid.distanceTables(target)]
+
+        # The jumps that have been made so far. Jumps only depend on where they
+        # start and on their direction, and the same jumps are made over and
+        # over again when checking the directions made up of components of a
+        # diagonal direction.
+        jumps = {}
+
+        # jumps from x into direction d, returns the next jump point or -1
+        def jump(x, d):
+            key = x * 32 + d
+
+            if key in jumps:
+                return jumps[key]
+
+            offset = offsets[d]
+            subs   = natural[d][1:]
+            y      = x + offset
+
+            while not blocked[y]:
+                if y == goal or (masks[y] and forced(masks[y], d)):
+                    jumps[key] = y
+                    return y
+
+                for s in subs:
+                    if jump(y, s) != -1:
+                        jumps[key] = y
+                        return y
+
+                y += offset
+
+            jumps[key] = -1
+            return -1
+
+        g[start]      = 0.0
+        parent[start] = start
+        unexplored    = [(self.heuristic(startCell, target), 0, start)]
+        pushed        = 1
+        expansions    = 0
+
+        while unexplored:
+            _, _, current = heappop(unexplored)
+
+            if explored[current]:
+                continue
+
+            explored[current] = True
+            expansions       += 1
+
+            # give up if planning takes too long, jumps are expensive so the
+            # time is checked more often than in astar
+            if expansions & 63 == 0 and perf_counter() > deadline:
+                raise PlanningTimeout("Planning took longer than allowed!")
+
+            # we found a path!
+            if current == goal:
+                jumpPoints = [current]
+
+                while current != start:
+                    current = parent[current]
+                    jumpPoints.append(current)
+
+                jumpPoints = [grid.cell(i) for i in reversed(jumpPoints)]
+                path       = [jumpPoints[0]]
+
+                # fill in the cells between the jump points
+                for a, b in zip(jumpPoints, jumpPoints[1:]):
+                    steps = max(abs(v - u) for u, v in zip(a, b))
+                    step  = [(v - u) // steps for u, v in zip(a, b)]
+                    path += [tuple(u + i * s for u, s in zip(a, step)) for i in range(1, steps + 1)]
+
+                return (path, expansions)
+
+            if current == start:
+                directions = range(len(offsets))
+            else:
+                d          = direction[current]
+                directions = natural[d] + forced(masks[current], d)
+
+            x, rest = divmod(current, sx)
+            y, z    = divmod(rest,    sy)
+
+            for d in directions:
+                jumpPoint = jump(current, d)
+
+                if jumpPoint == -1:
+                    continue
+
+                jx, rest = divmod(jumpPoint, sx)
+                jy, jz   = divmod(rest,      sy)
+                cost     = g[current] + max(abs(jx - x), abs(jy - y), abs(jz - z)) * stepCosts[d]
+
+                if cost < g[jumpPoint] and not explored[jumpPoint]:
+                    if g[jumpPoint] == inf:
+                        queued[jumpPoint] = pushed
+                        pushed           += 1
+
+                    g[jumpPoint]         = cost
+                    parent[jumpPoint]    = current
+                    direction[jumpPoint] = d
+
+                    heappush(unexplored, ( cost + sqrt(tx[jx] + ty[jy] + tz[jz])
+                                         , queued[jumpPoint]
+                                         , jumpPoint
+                                         ))
+
+        raise PathUnreachable("Cannot find a path to target!")
+
+    # Turns a sequence of grid cells into a path of points through the middles
+    # of the cells that ends at the target.
+    def pathFromCells(self, cells, target):
+        return [self.getPoint(cell) for cell in cells] + [target]
+
+    # Shortcuts a path wherever there is a line of sight: starting with the
+    # first waypoint, the path goes straight to the last waypoint that can be
+    # seen from there, and so on. The resulting path keeps the same clearance
+    # from obstacles as the original one, and it is never longer.
+    def smoothPath(self, path, minClearance = 0.0):
+        grid     = self.grid(minClearance)
+        smoothed = [path[0]]
+
+        for i in range(1, len(path) - 1):
+            if not grid.lineOfSight(smoothed[-1], path[i + 1]):
+                smoothed.append(path[i])
+
+        smoothed.append(path[-1])
+
+        return smoothed
+
     def postprocessPath(self, path):
         reducedPath = [path[0]]
 
@@ -231,12 +1908,137 @@ class Scene():
 
         reducedPath.append(path[-1])
 
-        print("[DEBUG] Original path: {}".format(path))
-        print("[DEBUG] Reduced path: {}".format(reducedPath))
+        if self.debug:
+            print("[DEBUG] Original path: {}".format(path))
+            print("[DEBUG] Reduced path: {}".format(reducedPath))
 
         return reducedPath
 
 
+# The scene of a worker process of Scene.planPaths, with its occupancy and its
+# search grid in shared memory.
+workerScene  = None
+workerMemory = None
+
+def attachWorkerScene(name, paddedShape, bitsShape, shape, dimensions, resolution, minClearance):
+    global workerScene, workerMemory
+
+    workerMemory = shared_memory.SharedMemory(name = name)
+    blocked      = np.ndarray(paddedShape, dtype = bool,     buffer = workerMemory.buf)
+    bits         = np.ndarray(bitsShape,   dtype = np.uint8, buffer = workerMemory.buf, offset = blocked.nbytes)
+
+    workerScene       = Scene(*dimensions, resolution, [], space = OccupancyGrid(shape, bits))
+    workerScene.debug = False
+
+    workerScene.flatGrids[workerScene.roundClearance(minClearance)] = Grid(None, resolution, padded = blocked)
+
+def planInWorker(query):
+    start, target, algorithm, minClearance, smooth = query
+
+    try:
+        return workerScene.planPath(Point(*start), Point(*target), algorithm, minClearance, smooth)
+    except Exception as e:
+        return e
+
+
+# The cheapest paths from a start cell to many cells of a scene, as found by
+# Scene.planFrom. Cells are settled when their cheapest path is known. If the
+# search was complete, all cells that are not settled cannot be reached at all.
+class ShortestPathTree():
+    def __init__(self, scene, grid, minClearance, start, costs, cameFrom, settled, complete):
+        self.scene        = scene
+        self.grid         = grid
+        self.minClearance = minClearance
+        self.start        = start
+        self.costs        = costs
+        self.cameFrom     = cameFrom
+        self.settled      = settled
+        self.complete     = complete
+
+    def __repr__(self):
+        return "<ShortestPathTree:{}:{} settled>".format(self.grid.cell(self.start), int(self.settled.sum()))
+
+    # the linear index of the cell of a point, or None if it is outside of the scene
+    def index(self, point):
+        if not self.scene.bounds.contains(point):
+            return None
+
+        return self.grid.index(self.scene.getCoordinate(point))
+
+    # checks whether the cheapest path to the given point is known
+    def isSettled(self, point):
+        i = self.index(point)
+        return i is not None and bool(self.settled[i])
+
+    # Checks whether there is a path to the given point. Raises an exception if
+    # that is unknown, because the search stopped before.
+    def isReachable(self, point):
+        if self.isSettled(point):
+            return True
+
+        i = self.index(point)
+
+        if self.complete or i is None or self.grid.blocked[i]:
+            return False
+
+        raise Exception("{} point has not been settled!".format(point))
+
+    # The cost of the cheapest path to the middle of the grid cell of the given
+    # point, or inf if there is none.
+    def cost(self, point):
+        if not self.isReachable(point):
+            return inf
+
+        return float(self.costs[self.index(point)])
+
+    # The grid cells along the cheapest path to the given point.
+    # O(length of the path)
+    def cellsTo(self, point):
+        if not self.isReachable(point):
+            raise PathUnreachable("Cannot find a path to target!")
+
+        i    = self.index(point)
+        path = [i]
+
+        while i != self.start:
+            i = int(self.cameFrom[i])
+            path.append(i)
+
+        return [self.grid.cell(i) for i in reversed(path)]
+
+    # The cheapest path to the given point, like Scene.planPath.
+    def pathTo(self, point, smooth = False):
+        path = self.scene.pathFromCells(self.cellsTo(point), point)
+
+        if smooth:
+            path = self.scene.smoothPath(path, self.minClearance)
+
+        return self.scene.postprocessPath(path)
+
+
+# Plans the given paths with all planning algorithms of the scene and reports
+# how long planning took, how many cells were expanded and how long the paths
+# are.
+def benchmark(scene, requests):
+    debug, scene.debug = scene.debug, False
+
+    for algorithm in scene.planners():
+        duration   = 0
+        expansions = 0
+        length     = 0
+
+        for start, target in requests:
+            planningStart = perf_counter()
+            path          = scene.planPath(start, target, algorithm)
+            duration     += perf_counter() - planningStart
+            expansions   += scene.lastExpansions
+            length       += sum(path[i - 1].distanceTo(path[i]) for i in range(1, len(path)))
+
+        print("{:12s} {:9.1f} ms {:9d} expansions {:8.2f} m".format(algorithm, 1000 * duration, expansions, length))
+
+    scene.debug = debug
+
+
 if __name__ == '__main__':
     table1 = Translate(Scale(Cube(), 1.30, 0.65, 0.75), 1.67, 0.00, 0.00)
     table2 = Translate(Scale(Cube(), 1.30, 0.85, 0.60), 1.67, 3.75, 0.00)
@@ -257,6 +2059,23 @@ if __name__ == '__main__':
     pathLength = 0
     i = 1
     while i < len(path):
-        pathLength += path[0].distanceTo(path[1])
+        pathLength += path[i - 1].distanceTo(path[i])
         i += 1
     print(pathLength)
+
+    print()
+    print("Benchmark on the demo scene:")
+    benchmark(scene, [(start, target), (Point(0.2, 0.2, 0.2), Point(3.8, 4.8, 1.8))])
+
+    # the scene of the path planning server, a 40 x 40 x 26 grid
+    table1   = Translate(Scale(Cube(), 1.30, 0.65, 0.75), 1.35, 0.68, 0.00)
+    table2   = Translate(Scale(Cube(), 1.30, 0.65, 0.75), 1.35, 2.68, 0.00)
+    obstacle = Translate(Scale(Cube(), 1.60, 0.8, 2.20), 1.25, 1.70, 0.00)
+    room     = Scene(4.0, 4.0, 2.6, 0.1, [table1, table2, obstacle])
+
+    print()
+    print("Benchmark on the scene of the path planning server:")
+    benchmark(room, [ (Point(0.2, 0.2, 1.0), Point(3.8, 3.8, 1.2))
+                    , (Point(2.0, 0.3, 0.5), Point(2.0, 3.7, 0.5))
+                    , (Point(0.5, 2.0, 0.3), Point(3.5, 2.0, 2.4))
+                    ])
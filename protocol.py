@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+
+# A compact binary encoding of the commands for the crazyflie, and a ring buffer
+# in shared memory that carries them from the servers to the controller thread.
+#
+# Every command is encoded as a frame of 16 bytes: an opcode, 3 bytes of
+# padding and three float32 values, e.g. the distances of a DistanceCommand.
+# Frames are written directly into the shared memory, so sending a command does
+# not pickle objects or wait for the feeder thread of a multiprocessing.Queue.
+
+import struct
+import time
+
+from controller      import DistanceCommand, PositionCommand, StartCommand, StopCommand
+from multiprocessing import Lock, RawArray
+from queue           import Empty, Full
+
+frame = struct.Struct("<B3xfff")
+
+# the opcodes of the commands
+START    = 1
+STOP     = 2
+DISTANCE = 3
+POSITION = 4
+
+# returns the opcode and the values of a command
+def commandFields(command):
+    if isinstance(command, DistanceCommand):
+        return (DISTANCE, command.dx, command.dy, command.dz)
+    elif isinstance(command, PositionCommand):
+        return (POSITION, command.x, command.y, command.z)
+    elif isinstance(command, StartCommand):
+        return (START, 0.0, 0.0, 0.0)
+    elif isinstance(command, StopCommand):
+        return (STOP, 0.0, 0.0, 0.0)
+    else:
+        raise Exception("Cannot encode command: {}".format(command))
+
+# the inverse of commandFields
+def commandFromFields(opcode, a, b, c):
+    if opcode == DISTANCE:
+        return DistanceCommand(a, b, c)
+    elif opcode == POSITION:
+        return PositionCommand(a, b, c)
+    elif opcode == START:
+        return StartCommand()
+    elif opcode == STOP:
+        return StopCommand()
+    else:
+        raise Exception("Unknown opcode: {}".format(opcode))
+
+def encodeCommand(command):
+    return frame.pack(*commandFields(command))
+
+def decodeCommand(data):
+    return commandFromFields(*frame.unpack(data))
+
+
+# A bounded queue of commands in shared memory, with the same interface as a
+# multiprocessing.Queue. Any number of processes may put commands into the
+# ring, but only one thread may get them, i.e. the controller thread.
+#
+# head counts the frames that were written and tail the frames that were read,
+# so frame i lives at slot i % capacity. Only writers change head and only the
+# reader changes tail. Nevertheless, the reader takes the lock as well to read
+# a frame: taking and releasing the lock are memory barriers, and without them
+# the reader could see the new head before the bytes of the frame on CPUs that
+# reorder stores (e.g. ARM). empty and qsize only read the counters, so their
+# result may already be outdated, like for a multiprocessing.Queue.
+class CommandRing():
+    # how long a blocking put or get sleeps before it checks again, in seconds
+    pollInterval = 0.0005
+
+    def __init__(self, capacity = 1024):
+        self.capacity = capacity
+        self.frames   = RawArray('B', capacity * frame.size)
+        self.counters = RawArray('Q', 2)
+        self.lock     = Lock()
+
+    def __repr__(self):
+        return "<CommandRing:{}/{}>".format(self.qsize(), self.capacity)
+
+    def qsize(self):
+        head, tail = self.counters
+        return head - tail
+
+    def empty(self):
+        return self.qsize() == 0
+
+    def full(self):
+        return self.qsize() >= self.capacity
+
+    # Encodes a command into the ring. When the ring is full, waits for the
+    # reader like Queue.put, or raises queue.Full.
+    def put(self, command, block = True, timeout = None):
+        fields   = commandFields(command)
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self.lock:
+                head, tail = self.counters
+
+                if head - tail < self.capacity:
+                    frame.pack_into(self.frames, (head % self.capacity) * frame.size, *fields)
+
+                    # the reader only sees the frame after the lock is released
+                    self.counters[0] = head + 1
+                    return
+
+            if not block or (deadline is not None and time.monotonic() > deadline):
+                raise Full
+
+            time.sleep(self.pollInterval)
+
+    def put_nowait(self, command):
+        self.put(command, block = False)
+
+    # Decodes the oldest command in the ring. When the ring is empty, waits for
+    # a writer like Queue.get, or raises queue.Empty.
+    def get(self, block = True, timeout = None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+
+        while True:
+            with self.lock:
+                head, tail = self.counters
+
+                if tail < head:
+                    fields = frame.unpack_from(self.frames, (tail % self.capacity) * frame.size)
+
+                    # only now the slot may be written again
+                    self.counters[1] = tail + 1
+                    return commandFromFields(*fields)
+
+            if not block or (deadline is not None and time.monotonic() > deadline):
+                raise Empty
+
+            time.sleep(self.pollInterval)
+
+    def get_nowait(self):
+        return self.get(block = False)
+
+
+if __name__ == '__main__':
+    from multiprocessing import Process, Queue
+
+    # how long it takes to get n commands from one process to another
+    def send(queue, n):
+        for i in range(n):
+            queue.put(DistanceCommand(0.1, 0.0, float(i)))
+
+    n = 100000
+
+    for queue in [Queue(), CommandRing()]:
+        sender = Process(target = send, args = (queue, n))
+        start  = time.perf_counter()
+        sender.start()
+
+        for i in range(n):
+            command = queue.get()
+
+            if command.dz != i:
+                raise Exception("Got command {} instead of {}!".format(command.dz, i))
+
+        duration = time.perf_counter() - start
+        sender.join()
+
+        print("{:12s} {:6.2f} us per command".format(type(queue).__name__, 1e6 * duration / n))
@@ -6,8 +6,11 @@
 # and insert it into the tree. Because we do that, we can associate additional
 # data with an element.
 #
-# Implemented functionality is insert, retrieving the minimum element, and
-# balancing (though the balancing might be incorrect).
+# Implemented functionality is insert, building a tree from a sorted list,
+# and removing the minimum element. Both insert and removal keep the tree
+# balanced, using the balancing from Kahrs, "Red-black trees with types".
+# The trees are persistent: operations return new trees and leave the old
+# ones untouched, so old versions can be kept around as snapshots.
 #
 # Author: Christopher Blöcker
 
@@ -298,7 +301,7 @@ class Node(RedBlackTree):
 
     # determines the depth of the tree
     def depth(self):
-        return 1 + min(self.left.depth(), self.right.depth())
+        return 1 + max(self.left.depth(), self.right.depth())
 
     # Counts the number of black nodes to the leaf nodes. In a balances tree,
     # there should be the same number of black nodes along all paths from the
@@ -310,39 +313,85 @@ class Node(RedBlackTree):
         return max(l, r) + (1 if self.isBlack() else 0)
 
     # "internal" method to find the minimum of the tree and to remove it.
+    # Removing from a black subtree makes it one black node shorter, which is
+    # repaired by __balanceLeft__ on the way up.
     def __popMin__(self):
         if self.left.isEmpty():
             return (self.element, self.right)
 
         (m, l) = self.left.__popMin__()
 
-        t = Node( element = self.element
-                , colour  = self.colour
-                , key     = self.key
-                , left    = l
-                , right   = self.right
-                ).balance()
+        if self.left.isBlack():
+            t = self.__balanceLeft__(l)
+        else:
+            t = Node( element = self.element
+                    , colour  = Colour.RED
+                    , key     = self.key
+                    , left    = l
+                    , right   = self.right
+                    )
 
         return (m, t)
 
+    # "internal" method to rebuild this node with a new left subtree that has
+    # one black node less than the right subtree on all paths.
+    def __balanceLeft__(self, left):
+        right = self.right
+
+        # the left subtree is red, so we can simply make it black
+        if left.isRed():
+            return Node( element = self.element
+                       , colour  = Colour.RED
+                       , key     = self.key
+                       , left    = Node( element = left.element
+                                       , key     = self.key
+                                       , left    = left.left
+                                       , right   = left.right
+                                       )
+                       , right   = right
+                       )
+
+        # the right subtree is black, so we make it red and rebalance
+        if right.isBlack():
+            return Node( element = self.element
+                       , key     = self.key
+                       , left    = left
+                       , right   = right.mkRed()
+                       ).balance()
+
+        # the right subtree is red and has a black left subtree, which we rotate
+        # to the top
+        return Node( element = right.left.element
+                   , colour  = Colour.RED
+                   , key     = self.key
+                   , left    = Node( element = self.element
+                                   , key     = self.key
+                                   , left    = left
+                                   , right   = right.left.left
+                                   )
+                   , right   = Node( element = right.element
+                                   , key     = self.key
+                                   , left    = right.left.right
+                                   , right   = right.right.mkRed()
+                                   ).balance()
+                   )
+
     # returns the minimum element and the new tree with the minimum removed
     # the minimum element is always in the leftmost leaf of the tree.
     # O(log(n))
     def popMin(self):
         (m, t) = self.__popMin__()
 
-        t.colour = Colour.BLACK
+        # the root must be black, but t may be shared with this tree, so we
+        # must not recolour it in place
+        if t.isRed():
+            t = Node( element = t.element
+                    , key     = self.key
+                    , left    = t.left
+                    , right   = t.right
+                    )
 
         return (m, t)
-        # ToDo: we SHOULD check whether the invariant holds after removing
-        #       something from the tree... but at the moment it doesn't...
-        #       we need to change how we balance the tree after removing something
-
-        # if t.checkInvariant():
-        #     return (m, t)
-        # else:
-        #     print(t)
-        #     raise Exception("Malformed tree!")
 
     # for testing whether popMin returns the correct result
     def getMin(self):
@@ -358,8 +407,33 @@ class Node(RedBlackTree):
         return min([self.key(self.element), self.left.getMin(), self.right.getMin()])
 
 
-if __name__ == '__main__':
-    from random import randint, random
+# Builds a balanced tree from a list of elements that is sorted by the key.
+# All nodes are black, except for those on the lowest level if it is not full.
+# O(n)
+def fromSortedList(elements, key = identity):
+    # the level that is red
+    redLevel = len(elements).bit_length() - 1
+
+    def build(lo, hi, level):
+        if lo >= hi:
+            return Empty(key)
+
+        mid = (lo + hi) // 2
+
+        return Node( element = elements[mid]
+                   , colour  = Colour.RED if level == redLevel and level > 0 else Colour.BLACK
+                   , key     = key
+                   , left    = build(lo,      mid, level + 1)
+                   , right   = build(mid + 1, hi,  level + 1)
+                   )
+
+    return build(0, len(elements), 0)
+
+
+# Checks that insert, fromSortedList and popMin keep the tree balanced and
+# return the right elements, and that old versions of a tree are not changed.
+def selfTest():
+    from random import randint
 
     l = [randint(0, 10) for _ in range(1000)]
     t = Empty()
@@ -367,7 +441,10 @@ if __name__ == '__main__':
     for x in l:
         t = t.insert(x)
 
-    t.checkInvariant()
+    if not t.checkInvariant():
+        raise Exception("Malformed tree after insert!")
+
+    snapshot = t
 
     while not t.isEmpty():
         shouldBeMin = t.getMin()
@@ -375,3 +452,62 @@ if __name__ == '__main__':
 
         if m != shouldBeMin:
             raise Exception("Wrong minimum, should be {} but is {}!".format(shouldBeMin, m))
+
+        if not t.checkInvariant():
+            raise Exception("Malformed tree after popMin!")
+
+    if snapshot.size() != len(l) or not snapshot.checkInvariant():
+        raise Exception("popMin changed an old version of the tree!")
+
+    t = fromSortedList(sorted(l))
+
+    if not t.checkInvariant():
+        raise Exception("Malformed tree from sorted list!")
+
+    for x in sorted(l):
+        m, t = t.popMin()
+
+        if m != x:
+            raise Exception("Wrong minimum, should be {} but is {}!".format(x, m))
+
+
+# Measures insert, fromSortedList and popMin for n random elements and
+# reports the depth of the resulting trees.
+def benchmark(n):
+    from random import random
+    from time   import perf_counter
+
+    l = [random() for _ in range(n)]
+    t = Empty()
+
+    start = perf_counter()
+    for x in l:
+        t = t.insert(x)
+    inserted = perf_counter() - start
+
+    print("n = {:d}".format(n))
+    print("  insert:         {:10.0f} ops/s, depth {:d}".format(n / inserted, t.depth()))
+
+    start = perf_counter()
+    s     = fromSortedList(sorted(l))
+    built = perf_counter() - start
+
+    print("  fromSortedList: {:10.0f} elements/s, depth {:d}".format(n / built, s.depth()))
+
+    start = perf_counter()
+    for _ in range(n // 2):
+        _, t = t.popMin()
+    popped = perf_counter() - start
+
+    print("  popMin:         {:10.0f} ops/s, depth {:d} after removing half of the elements".format((n // 2) / popped, t.depth()))
+
+
+if __name__ == '__main__':
+    import sys
+
+    selfTest()
+
+    sizes = [int(n) for n in sys.argv[1:]] or [10 ** 5, 10 ** 6]
+
+    for n in sizes:
+        benchmark(n)
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+
+# A scheduler for loops that should run at a fixed rate, like the control loop.
+#
+# The deadlines of the periods are absolute points in time on the monotonic
+# clock, so neither the time a period takes nor inaccurate sleeps accumulate
+# to a drift, and adjustments of the wall clock do not affect the loop. To hit
+# a deadline accurately, the scheduler sleeps until shortly before it and then
+# spins for the rest of the time.
+
+import time
+
+from time import monotonic_ns
+
+# What happens when a period takes longer than the period itself:
+#   SKIP    - the periods that were missed are dropped, and the loop continues
+#             with the next deadline on the original schedule
+#   CATCHUP - the missed periods run back to back without waiting, until the
+#             loop is on schedule again, but at most maxBehind of them
+#   DEGRADE - the period is doubled (up to maxPeriod), and halved again after
+#             recoverAfter periods on time, until it is back at the nominal one
+SKIP    = "skip"
+CATCHUP = "catchup"
+DEGRADE = "degrade"
+
+class FixedRateScheduler():
+    def __init__(self, period, policy = SKIP, spin = 0.0005, maxBehind = 5, maxPeriod = None, recoverAfter = 50):
+        if policy not in [SKIP, CATCHUP, DEGRADE]:
+            raise Exception("Unknown overrun policy: {}".format(policy))
+
+        # all times are kept in nanoseconds
+        self.nominal      = int(period * 1e9)
+        self.periodNs     = self.nominal
+        self.maxPeriod    = int((maxPeriod if maxPeriod is not None else 8 * period) * 1e9)
+        self.policy       = policy
+        self.spin         = int(spin * 1e9)
+        self.maxBehind    = maxBehind
+        self.recoverAfter = recoverAfter
+
+        self.deadline = None
+        self.onTime   = 0
+
+        # statistics
+        self.ticks    = 0
+        self.overruns = 0
+        self.skipped  = 0
+
+    def __repr__(self):
+        return "<FixedRateScheduler:{:.2f}ms:{}>".format(self.periodNs / 1e6, self.policy)
+
+    # the current period in seconds, which is only longer than the nominal
+    # period while the scheduler degrades
+    def period(self):
+        return self.periodNs / 1e9
+
+    # starts the schedule, the first period ends one period from now
+    def start(self):
+        self.deadline = monotonic_ns() + self.periodNs
+        self.onTime   = 0
+
+    # Waits until the end of the current period and returns how late that is,
+    # in seconds, which is more than a period if the period was overrun.
+    def wait(self):
+        if self.deadline is None:
+            self.start()
+
+        deadline  = self.deadline
+        remaining = deadline - monotonic_ns()
+
+        if remaining > self.spin:
+            time.sleep((remaining - self.spin) / 1e9)
+
+        # sleeping is not accurate enough, so the rest of the time is spent
+        # spinning, but the other threads may run in the meantime
+        while monotonic_ns() < deadline:
+            time.sleep(0)
+
+        now  = monotonic_ns()
+        late = now - deadline
+
+        self.ticks += 1
+
+        if late < self.periodNs:
+            self.deadline += self.periodNs
+            self.__onTime__()
+        else:
+            self.overruns += 1
+            self.__overrun__(now, late)
+
+        return late / 1e9
+
+    # "internal" method that moves the deadline after an overrun, according to
+    # the policy
+    def __overrun__(self, now, late):
+        behind      = late // self.periodNs
+        self.onTime = 0
+
+        if self.policy == SKIP:
+            self.skipped  += behind
+            self.deadline += (behind + 1) * self.periodNs
+
+        elif self.policy == CATCHUP:
+            # the periods that are too far behind are dropped anyway
+            dropped        = max(behind - self.maxBehind, 0)
+            self.skipped  += dropped
+            self.deadline += (dropped + 1) * self.periodNs
+
+        else:
+            self.periodNs = min(2 * self.periodNs, self.maxPeriod)
+            self.deadline = now + self.periodNs
+
+    # "internal" method that counts the periods on time, and speeds up again
+    # after enough of them when the scheduler degraded
+    def __onTime__(self):
+        if self.periodNs == self.nominal:
+            return
+
+        self.onTime += 1
+
+        if self.onTime >= self.recoverAfter:
+            self.periodNs = max(self.periodNs // 2, self.nominal)
+            self.onTime   = 0
+
+
+if __name__ == '__main__':
+    import numpy as np
+
+    # how accurately a loop runs at 200Hz, compared to sleeping for the rest of
+    # the period like the control loop did before
+    period = 0.005
+    ticks  = 400
+
+    def naive():
+        starts = []
+
+        for _ in range(ticks):
+            start = time.time()
+            starts.append(time.perf_counter())
+            delta = period - (time.time() - start)
+
+            if delta > 0:
+                time.sleep(delta)
+
+        return starts
+
+    def scheduled():
+        starts    = []
+        scheduler = FixedRateScheduler(period, CATCHUP)
+        scheduler.start()
+
+        for _ in range(ticks):
+            starts.append(time.perf_counter())
+            scheduler.wait()
+
+        return starts
+
+    for loop in [naive, scheduled]:
+        starts  = np.array(loop())
+        periods = 1000 * np.diff(starts)
+        drift   = 1000 * (starts[-1] - starts[0] - (ticks - 1) * period)
+
+        print("{:10s} period {:.3f}ms (p99 {:.3f}ms), drift after {} ticks {:.2f}ms".format(
+            loop.__name__, periods.mean(), np.percentile(periods, 99), ticks, drift))
@@ -1,61 +1,428 @@
 # Author: Christopher Blöcker, Timotheus Kampik, Tobias Sundqvist
 
+import asyncio
+
 from http.server  import HTTPServer, BaseHTTPRequestHandler
 from json         import loads, dumps
 from json.decoder import JSONDecodeError
+from collections  import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from queue        import Full
+from threading    import BoundedSemaphore, Condition, Lock
 from controller   import *
+from dstar        import DStarLite
 
-# The request handler for commands that should be sent to the crazyflie.
-class CrazyHandler(BaseHTTPRequestHandler):
-    def _set_headers(self):
-        self.send_response(200)
-        self.send_header('Content-type', 'text/json')
-        self.end_headers()
+# Turns a decoded JSON request into the command for the crazyflie, e.g.
+# { "command" : "start" } or { "distance" : [dx, dy, dz] }.
+def parseCommand(json):
+    if "command" in json:
+        if json["command"] == "start":
+            return StartCommand()
+        elif json["command"] == "stop":
+            return StopCommand()
+        else:
+            raise Exception("Invalid command: {}".format(json["command"]))
 
-    def do_POST(self):
-        content_length = int(self.headers['Content-Length'])
-        request        = self.rfile.read(content_length)
+    elif "distance" in json:
+        [ dx, dy, dz ] = json["distance"]
+
+        return DistanceCommand(dx, dy, dz)
 
+    else:
+        raise Exception("Unexpected input: {}".format(json))
+
+
+# The server for commands that should be sent to the crazyflie, on top of
+# asyncio. Clients can talk to it in two ways, told apart by the first line
+# they send:
+#   * HTTP POST requests with a JSON command as body, where the connection is
+#     kept alive, so that many commands can be sent over one connection
+#   * newline-delimited JSON, one command per line, for clients that stream
+#     commands, e.g. a joystick bridge. Every line is answered with one line.
+# GET /stats reports the timings of the control loop, if they are given.
+class CommandServer():
+    # print every command, which is slow when commands come in quickly
+    debug = False
+
+    def __init__(self, commandQueue, timings = None):
+        self.commandQueue = commandQueue
+        self.timings      = timings
+
+    # Queues the command in a request for the crazyflie and returns the reply.
+    # This runs in the event loop, so it must never wait for the queue: when
+    # the queue is full, the command is rejected.
+    def handle(self, request):
         try:
-            json = loads(request.decode())
-            print("[DEBUG] Received request: {}".format(str(json)))
+            json = loads(request)
 
-            if "command" in json:
-                if json["command"] == "start":
-                    self.server.commandQueue.put(StartCommand())
-                elif json["command"] == "stop":
-                    self.server.commandQueue.put(StopCommand())
-                else:
-                    raise Exception("Invalid command: {}".format(json["command"]))
+            if self.debug:
+                print("[DEBUG] Received request: {}".format(str(json)))
 
-            elif "distance" in json:
-                [ dx, dy, dz ] = json["distance"]
+            self.commandQueue.put_nowait(parseCommand(json))
+
+            return { "ok" : json }
+        except Full:
+            return { "error" : "Command queue is full, the command was dropped!" }
+        except Exception as e:
+            return { "error" : str(e) }
 
-                self.server.commandQueue.put(DistanceCommand(dx, dy, dz))
+    async def run(self, hostname, port):
+        server = await asyncio.start_server(self.serve, hostname, port)
 
+        async with server:
+            await server.serve_forever()
+
+    # serves one client connection until the client closes it
+    async def serve(self, reader, writer):
+        try:
+            line = await reader.readline()
+
+            if line.lstrip().startswith(b"{"):
+                await self.__streamCommands__(line, reader, writer)
             else:
-                raise Exception("Unexpected input: {}".format(json))
+                await self.__serveRequests__(line, reader, writer)
 
-            reply = { "ok" : json }
-        except Exception as e:
-           reply = { "error" : str(e) }
+        except (ConnectionError, asyncio.IncompleteReadError, ValueError):
+            pass
 
-        self._set_headers()
-        self.wfile.write(dumps(reply).encode())
+        finally:
+            writer.close()
+
+    # "internal" method that handles newline-delimited JSON commands
+    async def __streamCommands__(self, line, reader, writer):
+        while line:
+            if line.strip():
+                writer.write(dumps(self.handle(line)).encode() + b"\n")
+                await writer.drain()
+
+            line = await reader.readline()
+
+    # "internal" method that handles HTTP requests, as long as the client
+    # keeps the connection alive. Like BaseHTTPRequestHandler, malformed
+    # requests are answered with 400 and the connection is closed.
+    async def __serveRequests__(self, line, reader, writer):
+        while line:
+            if not line.strip():
+                line = await reader.readline()
+                continue
+
+            try:
+                method, path, version, headers = await self.__readRequest__(line, reader)
+
+                if method == "POST" and "content-length" not in headers:
+                    raise ValueError("Missing Content-Length")
+
+                length = headers.get("content-length", "0")
+
+                if not length.isdigit():
+                    raise ValueError("Bad Content-Length: {}".format(length))
+
+                length = int(length)
+
+            except ValueError as e:
+                await self.__respond__(writer, "400 Bad Request", { "error" : str(e) }, False)
+                break
+
+            body = await reader.readexactly(length)
+
+            if method == "POST":
+                status, reply = "200 OK", self.handle(body)
+            elif method == "GET" and path == "/stats" and self.timings is not None:
+                status, reply = "200 OK", self.timings.stats()
+            elif method == "GET":
+                status, reply = "404 Not Found", { "error" : "Unknown path: {}".format(path) }
+            else:
+                status, reply = "501 Not Implemented", { "error" : "Unsupported method: {}".format(method) }
+
+            # HTTP/1.1 keeps connections alive by default, HTTP/1.0 only on request
+            connection = headers.get("connection", "").lower()
+            keepAlive  = connection == "keep-alive" if version == "HTTP/1.0" else connection != "close"
+
+            await self.__respond__(writer, status, reply, keepAlive)
+
+            if not keepAlive:
+                break
+
+            line = await reader.readline()
+
+    # "internal" method that parses the request line and the headers of a
+    # request, raises a ValueError if they are malformed
+    async def __readRequest__(self, line, reader):
+        parts = line.decode("latin-1").split()
+
+        if len(parts) != 3 or not parts[2].startswith("HTTP/"):
+            raise ValueError("Bad request line: {!r}".format(line.decode("latin-1").strip()))
+
+        method, path, version = parts
+        headers               = {}
+
+        while True:
+            header = await reader.readline()
+
+            if not header.strip():
+                break
+
+            name, colon, value = header.decode("latin-1").partition(":")
+
+            if not colon:
+                raise ValueError("Bad header: {!r}".format(header.decode("latin-1").strip()))
+
+            headers[name.strip().lower()] = value.strip()
+
+        return (method, path, version, headers)
+
+    # "internal" method that sends the reply to a request
+    async def __respond__(self, writer, status, reply, keepAlive):
+        content = dumps(reply).encode()
+        writer.write("HTTP/1.1 {}\r\nContent-Type: text/json\r\nContent-Length: {}\r\nConnection: {}\r\n\r\n".format(
+            status, len(content), "keep-alive" if keepAlive else "close").encode() + content)
+        await writer.drain()
 
 
 # Run a server and listen for commands sent to the crazyflie.
-def runServer(hostname, port, commandQueue):
-    server              = HTTPServer((hostname, port), CrazyHandler)
-    server.commandQueue = commandQueue
-    server.serve_forever()
+def runServer(hostname, port, commandQueue, timings = None):
+    asyncio.run(CommandServer(commandQueue, timings).run(hostname, port))
+
+
+# An HTTPServer that handles requests concurrently on a fixed number of worker
+# threads, so that a slow request does not block the others. At most
+# 2 * workers requests are accepted at a time, further connections wait in the
+# listen backlog of the socket until a worker is free.
+class PooledHTTPServer(HTTPServer):
+    def __init__(self, address, handler, workers = 4):
+        super().__init__(address, handler)
+
+        self.workers = workers
+        self.pool    = ThreadPoolExecutor(workers)
+        self.slots   = BoundedSemaphore(2 * workers)
+
+    def process_request(self, request, client_address):
+        self.slots.acquire()
+
+        try:
+            self.pool.submit(self.__processRequest__, request, client_address)
+        except Exception:
+            self.slots.release()
+            self.shutdown_request(request)
+            raise
+
+    def server_close(self):
+        super().server_close()
+        self.pool.shutdown(wait = True)
+
+    # "internal" method that handles a request on a worker thread, like
+    # socketserver.ThreadingMixIn
+    def __processRequest__(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+            self.slots.release()
+
+
+# A lock that many readers can hold at the same time, but a writer only alone.
+# Waiting writers go first, so that a stream of readers cannot starve them.
+class ReadWriteLock():
+    def __init__(self):
+        self.condition = Condition()
+        self.readers   = 0
+        self.writing   = False
+        self.waiting   = 0
+
+    def acquireRead(self):
+        with self.condition:
+            while self.writing or self.waiting > 0:
+                self.condition.wait()
+
+            self.readers += 1
+
+    def releaseRead(self):
+        with self.condition:
+            self.readers -= 1
+
+            if self.readers == 0:
+                self.condition.notify_all()
+
+    def acquireWrite(self):
+        with self.condition:
+            self.waiting += 1
+
+            while self.writing or self.readers > 0:
+                self.condition.wait()
+
+            self.waiting -= 1
+            self.writing  = True
+
+    def releaseWrite(self):
+        with self.condition:
+            self.writing = False
+            self.condition.notify_all()
+
+
+# A bounded cache of planned paths with least recently used eviction.
+# Paths are cached as grid cells, keyed on the cells of start and target and the
+# planning options, so a repeated request does not have to search again. All
+# cached paths are dropped when the version of the scene changes. The cache
+# can be shared by the worker threads of the server, but paths are planned
+# outside of its lock, so the same path may be planned twice.
+#
+# Paths planned with "astar" are planned with A* at first. When a target is
+# requested again after obstacles changed, a D* Lite planner is created for
+# it, which finds paths of the same length. One planner is kept for each of
+# the plannerCapacity most recently used of these targets, so that later
+# requests to them, from other starts or after further changes, only repair
+# the costs of the last search instead of searching from scratch. The first
+# search of D* Lite takes about three times as long as A*, so it only pays off
+# for targets in a changing scene. D* Lite searches backwards from the target,
+# so obstacles that change close to the target invalidate most of its costs,
+# and such a repair may take as long as a new search.
+class PathCache():
+    def __init__(self, scene, capacity = 1024, plannerCapacity = 8):
+        self.scene           = scene
+        self.capacity        = capacity
+        self.paths           = OrderedDict()
+        self.version         = scene.version
+        self.hits            = 0
+        self.misses          = 0
+        self.lock            = Lock()
+        self.plannerCapacity = plannerCapacity
+        self.planners        = OrderedDict()
+        self.repairs         = 0
+
+        # the version of the scene when the targets without a planner were
+        # planned the last time
+        self.targets = OrderedDict()
+
+    def __len__(self):
+        return len(self.paths)
+
+    # Plans a path like Scene.planPath, but reuses the cells of a cached path
+    # if there is one.
+    def planPath(self, start, target, algorithm = "astar", minClearance = 0.0, smooth = False, timeout = None):
+        # the scene rounds the clearance anyway, so paths for close clearances
+        # are the same
+        minClearance = self.scene.roundClearance(minClearance)
+
+        key = ( self.scene.getCoordinate(start)
+              , self.scene.getCoordinate(target)
+              , algorithm
+              , minClearance
+              )
+
+        with self.lock:
+            if self.version != self.scene.version:
+                self.paths.clear()
+                self.version = self.scene.version
+
+            cells = self.paths.get(key)
+
+            if cells is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+                self.paths.move_to_end(key)
+
+        if cells is None:
+            version = self.scene.version
+
+            if algorithm == "astar":
+                cells = self.repairPath(start, target, minClearance, timeout)
+            else:
+                cells = self.scene.planCells(start, target, algorithm, minClearance, timeout)
+
+            with self.lock:
+                if version == self.version:
+                    self.paths[key] = cells
+
+                    if len(self.paths) > self.capacity:
+                        self.paths.popitem(last = False)
+
+        path = self.scene.pathFromCells(cells, target)
+
+        if smooth:
+            path = self.scene.smoothPath(path, minClearance)
+
+        return self.scene.postprocessPath(path)
+
+    # Plans the cells of a path with A*, or with the D* Lite planner for the
+    # target, which is created when the target is requested again after
+    # obstacles changed. The planner keeps its state between requests, so a
+    # request that uses it has to wait for another one that is using it.
+    def repairPath(self, start, target, minClearance = 0.0, timeout = None):
+        key     = (self.scene.getCoordinate(target), minClearance)
+        version = self.scene.version
+
+        with self.lock:
+            planner = self.planners.get(key)
+
+            # the scene dropped the grid of the planner, so it does not see
+            # changes of the obstacles any more
+            if planner is not None and not planner[0].isCurrent():
+                del self.planners[key]
+                planner = None
+
+            if planner is not None:
+                self.repairs += 1
+                self.planners.move_to_end(key)
+            else:
+                planned           = self.targets.pop(key, None)
+                self.targets[key] = version
+
+                if len(self.targets) > self.capacity:
+                    self.targets.popitem(last = False)
+
+        if planner is None and (planned is None or planned == version):
+            return self.scene.planCells(start, target, "astar", minClearance, timeout)
+
+        if planner is None:
+            with self.lock:
+                self.targets.pop(key, None)
+
+            planner = (DStarLite(self.scene, start, target, minClearance), Lock())
+
+            with self.lock:
+                planner = self.planners.setdefault(key, planner)
+
+                if len(self.planners) > self.plannerCapacity:
+                    self.planners.popitem(last = False)
+
+        dstar, lock = planner
+
+        with lock:
+            dstar.moveTo(start)
+            return dstar.planCells(timeout)
+
+    # drops all cached paths and planners
+    def clear(self):
+        with self.lock:
+            self.paths.clear()
+            self.planners.clear()
+            self.targets.clear()
+
+    def stats(self):
+        with self.lock:
+            return { "hits"     : self.hits
+                   , "misses"   : self.misses
+                   , "size"     : len(self.paths)
+                   , "capacity" : self.capacity
+                   , "version"  : self.version
+                   , "planners" : len(self.planners)
+                   , "repairs"  : self.repairs
+                   }
 
 
 # The request handler for the path planning server.
 # When the crazyflie sends a path planning request, the path planning server
 # plans a path in the static scene and sends a sequence of PositionCommands to
 # the crazyflie.
+# Requests are handled concurrently, so planning holds the read side of the
+# scene lock and changing obstacles the write side.
 class PathPlanner(BaseHTTPRequestHandler):
+    # seconds to wait for a client before giving up on its connection
+    timeout = 10
+
     def _set_headers(self):
         self.send_response(200)
         self.send_header('Content-type', 'text/json')
@@ -69,38 +436,159 @@ class PathPlanner(BaseHTTPRequestHandler):
             json = loads(request.decode())
             print("[DEBUG] Received request: {}".format(str(json)))
 
-            start, target = json["start"], json["target"]
+            # obstacles that appear or disappear at runtime
+            if self.path == "/obstacles":
+                self.server.sceneLock.acquireWrite()
+
+                try:
+                    obstacles = self.changeObstacles(json)
+                finally:
+                    self.server.sceneLock.releaseWrite()
+
+                self.reply({ "ok" : json, "obstacles" : obstacles })
+                return
+
+            start = json["start"]
+            start = Point(start[0], start[1], start[2])
 
-            start  = Point(start[0],  start[1],  start[2])
-            target = Point(target[0], target[1], target[2])
+            # optionally, the minimum distance to keep from obstacles in meters
+            clearance = float(json.get("clearance", 0.0))
+
+            # optionally, how many seconds planning may take at most, planning
+            # is cancelled when it takes longer
+            timeout = min(float(json.get("timeout", self.server.planningTimeout)), self.server.planningTimeout)
+
+            # A batch of targets is only checked for whether and how far they
+            # can be reached, with a single search for all of them.
+            if "targets" in json:
+                self.server.sceneLock.acquireRead()
+
+                try:
+                    targets = self.checkTargets(start, json["targets"], clearance, timeout)
+                finally:
+                    self.server.sceneLock.releaseRead()
+
+                self.reply({ "ok" : json, "targets" : targets })
+                return
+
+            target    = json["target"]
+            target    = Point(target[0], target[1], target[2])
+            algorithm = json.get("algorithm", "astar")
+
+            # every waypoint costs the crazyflie a stop, so waypoints that can
+            # be skipped are dropped unless the request says otherwise
+            smooth = bool(json.get("smooth", True))
 
             planningStart = time.time()
-            path = self.server.scene.planPath(start, target)
+            self.server.sceneLock.acquireRead()
+            try:
+                path = self.server.paths.planPath(start, target, algorithm, clearance, smooth, timeout)
+            finally:
+                self.server.sceneLock.releaseRead()
             print("[DEBUG] Found path: {:s}".format(str(path)))
             print("[DEBUG] Path planning took {:.2f}s.".format(time.time() - planningStart))
-            for waypoint in path:
-                self.server.commandQueue.put(PositionCommand(waypoint.x, waypoint.y, waypoint.z))
 
-            else:
-                raise Exception("Unexpected input: {}".format(json))
+            # The waypoints of concurrently planned paths must not interleave.
+            # While the queue is full, the other threads wait for the lock as
+            # well, so the waypoints wait for at most commandTimeout seconds
+            # altogether.
+            with self.server.commandLock:
+                sendDeadline = time.monotonic() + self.server.commandTimeout
+
+                for sent, waypoint in enumerate(path):
+                    try:
+                        self.server.commandQueue.put( PositionCommand(waypoint.x, waypoint.y, waypoint.z)
+                                                    , timeout = max(0.0, sendDeadline - time.monotonic())
+                                                    )
+                    except Full:
+                        raise Exception("Command queue is full, only {} of {} waypoints were sent!".format(sent, len(path)))
 
             reply = { "ok" : json }
+        except PathUnreachable as e:
+           reply = { "error" : str(e), "unreachable" : True }
         except Exception as e:
            reply = { "error" : str(e) }
 
+        self.reply(reply)
+
+    # GET /stats reports the hits and misses of the path cache.
+    def do_GET(self):
+        if self.path == "/stats":
+            reply = self.server.paths.stats()
+        else:
+            reply = { "error" : "Unknown path: {}".format(self.path) }
+
+        self.reply(reply)
+
+    def reply(self, reply):
         self._set_headers()
         self.wfile.write(dumps(reply).encode())
 
+    # Adds obstacles to and removes them from the scene. A box obstacle is
+    # given as { "name" : ..., "size" : [x, y, z], "position" : [x, y, z] },
+    # like a scaled and translated cube. Returns the names of all obstacles.
+    def changeObstacles(self, json):
+        obstacles = self.server.obstacles
+
+        for name in json.get("remove", []):
+            if name not in obstacles:
+                raise Exception("Unknown obstacle: {}".format(name))
+
+            self.server.scene.removeObstacle(obstacles.pop(name))
+
+        for box in json.get("add", []):
+            name = box["name"]
+
+            if name in obstacles:
+                raise Exception("Obstacle {} exists already!".format(name))
+
+            [ sx, sy, sz ] = box["size"]
+            [ x,  y,  z  ] = box["position"]
+
+            obstacles[name] = Translate(Scale(Cube(), sx, sy, sz), x, y, z)
+            self.server.scene.addObstacle(obstacles[name])
+
+        return sorted(obstacles)
+
+    # For every target, whether it can be reached from start and the length of
+    # the path to it.
+    def checkTargets(self, start, targets, clearance, timeout = None):
+        planningStart = time.time()
+        targets       = [Point(target[0], target[1], target[2]) for target in targets]
+        tree          = self.server.scene.planFrom(start, targets, clearance, timeout)
+        print("[DEBUG] Checking {} targets took {:.2f}s.".format(len(targets), time.time() - planningStart))
+
+        results = []
+
+        for target in targets:
+            reachable = tree.isReachable(target)
+
+            results.append({ "target"    : [target.x, target.y, target.z]
+                           , "reachable" : reachable
+                           , "distance"  : tree.cost(target) if reachable else None
+                           })
+
+        return results
+
 
-# Run the path planning server and assume a static scene with static obstacles.
-def runPathPlanner(hostname, port, commandQueue):
+# Run the path planning server, initially with the static obstacles of the
+# room. Requests are handled by a pool of worker threads, and planning a path
+# may take at most planningTimeout seconds. Sending its waypoints to a full
+# command queue may take at most commandTimeout seconds.
+def runPathPlanner(hostname, port, commandQueue, workers = 4, planningTimeout = 5.0, commandTimeout = 1.0):
     # the static scene
     table1 = Translate(Scale(Cube(), 1.30, 0.65, 0.75), 1.35, 0.68, 0.00)
     table2 = Translate(Scale(Cube(), 1.30, 0.65, 0.75), 1.35, 2.68, 0.00)
 
     obstacle = Translate(Scale(Cube(), 1.60, 0.8, 2.20), 1.25, 1.70, 0.00)
 
-    server              = HTTPServer((hostname, port), PathPlanner)
-    server.commandQueue = commandQueue
-    server.scene        = Scene(4.0, 4.0, 2.6, 0.1, [table1, table2, obstacle])
+    server                 = PooledHTTPServer((hostname, port), PathPlanner, workers)
+    server.commandQueue    = commandQueue
+    server.commandLock     = Lock()
+    server.planningTimeout = planningTimeout
+    server.commandTimeout  = commandTimeout
+    server.obstacles       = { "table1" : table1, "table2" : table2, "obstacle" : obstacle }
+    server.scene           = Scene(4.0, 4.0, 2.6, 0.1, [table1, table2, obstacle], cacheDir = "scenecache")
+    server.sceneLock       = ReadWriteLock()
+    server.paths           = PathCache(server.scene)
     server.serve_forever()
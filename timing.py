@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+
+# Timings of the control loop, to check whether the controller keeps its rate
+# and to find out what takes the time when it does not.
+#
+# For every control period, the controller thread records how long each phase
+# of the period took. The timings are kept in a ring buffer in shared memory,
+# so that the web interface, which runs in another process, can report them.
+
+import numpy as np
+
+from math            import inf
+from multiprocessing import RawArray
+
+# the phases of a control period, and the time from the start of the previous
+# period to the start of this one
+phases = ["command", "control", "setpoint", "log", "overshoot", "period"]
+
+# the bins of the histogram of the jitter, i.e. how much a period deviates
+# from the nominal period, in milliseconds
+jitterEdges = [0.0, 0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, inf]
+
+
+# A ring buffer of the timings of the last capacity control periods, in
+# seconds. Only the controller thread writes to it, without a lock: it writes a
+# row and then counts it. Readers copy the rows they want and drop those that
+# the writer may have overwritten in the meantime.
+class TickTimings():
+    def __init__(self, period, capacity = 4096):
+        self.period    = period
+        self.capacity  = capacity
+        self.rows      = RawArray('d', capacity * len(phases))
+        self.counters  = RawArray('Q', 1)
+        self.lastStart = None
+
+    def __repr__(self):
+        return "<TickTimings:{}>".format(self.counters[0])
+
+    def __len__(self):
+        return min(self.counters[0], self.capacity)
+
+    # Records the timings of a control period that started at start, with one
+    # duration for every phase except for the period.
+    def record(self, start, command, control, setpoint, log, overshoot):
+        head   = self.counters[0]
+        offset = (head % self.capacity) * len(phases)
+        period = 0.0 if self.lastStart is None else start - self.lastStart
+
+        self.rows[offset : offset + len(phases)] = [command, control, setpoint, log, overshoot, period]
+        self.counters[0] = head + 1
+        self.lastStart   = start
+
+    # returns the timings of the last recorded period, or zeros
+    def last(self):
+        head = self.counters[0]
+
+        if head == 0:
+            return [0.0] * len(phases)
+
+        offset = ((head - 1) % self.capacity) * len(phases)
+        return self.rows[offset : offset + len(phases)]
+
+    # Returns a copy of the timings of the last (at most) window periods, with
+    # one row per period and one column per phase.
+    def snapshot(self, window = None):
+        table = np.frombuffer(self.rows, dtype = np.float64).reshape(self.capacity, len(phases))
+        head  = self.counters[0]
+        count = min(head, self.capacity if window is None else min(window, self.capacity))
+        rows  = table[np.arange(head - count, head) % self.capacity]
+
+        # the writer may have overwritten the oldest rows while they were
+        # copied, up to the one it is writing now
+        overwritten = self.counters[0] - self.capacity + 1 - (head - count)
+
+        return rows[max(overwritten, 0):]
+
+    # Summarises the timings of the last (at most) window periods: the median,
+    # the 99th percentile and the maximum of every phase, how many periods
+    # took longer than the nominal period and a histogram of the jitter, all
+    # in milliseconds.
+    def stats(self, window = None):
+        rows   = 1000 * self.snapshot(window)
+        result = { "ticks"  : int(self.counters[0])
+                 , "window" : len(rows)
+                 , "period" : 1000 * self.period
+                 }
+
+        if len(rows) == 0:
+            return result
+
+        p50, p99 = np.percentile(rows, [50, 99], axis = 0)
+        maximum  = rows.max(axis = 0)
+
+        result["phases"] = { phase : { "p50" : p50[i], "p99" : p99[i], "max" : maximum[i] }
+                             for i, phase in enumerate(phases)
+                           }
+
+        work             = rows[:, :4].sum(axis = 1)
+        result["missed"] = int(np.count_nonzero(work > 1000 * self.period))
+
+        periods = rows[:, phases.index("period")]
+        jitter  = np.abs(periods[periods > 0] - 1000 * self.period)
+        counts  = np.histogram(jitter, bins = jitterEdges)[0]
+
+        result["jitter"] = { "{}-{}".format(low, high) if high < inf else ">{}".format(low) : int(count)
+                             for low, high, count in zip(jitterEdges, jitterEdges[1:], counts)
+                           }
+
+        return result